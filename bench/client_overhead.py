@@ -0,0 +1,63 @@
+# Cost of building the LLM and embedding clients a question needs, per question vs shared.
+#   python bench/client_overhead.py --questions 50
+import argparse
+import os
+import sys
+import time
+
+from stubs import StubEnvironment
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+API_KEY = "sk-benchmark"
+
+
+def per_question(model):
+    # What one question built before the registry: routing, endpoint, grading and vectorstore clients
+    create_openai(None, API_KEY)
+    create_chat_openai(None, API_KEY)
+    create_openai(None, API_KEY)
+    create_hashing_embeddings(None)
+    create_bedrock(model, 0.5)
+
+
+def shared(model):
+    CLIENTS.get("openai", api_key=API_KEY)
+    CLIENTS.get("chat_openai", api_key=API_KEY)
+    CLIENTS.get("openai", api_key=API_KEY)
+    CLIENTS.get("hashing_embeddings")
+    CLIENTS.get("bedrock", model, temperature=0.5)
+
+
+def measure(func, model, questions):
+    start = time.perf_counter()
+    for _ in range(questions):
+        func(model)
+    return (time.perf_counter() - start) / questions * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--model", default="anthropic.claude-v2")
+    args = parser.parse_args()
+
+    # Bedrock reads its profile while building the client, the stubs provide one
+    stubs = StubEnvironment()
+    os.environ.update(stubs.environment())
+
+    global CLIENTS, create_bedrock, create_chat_openai, create_hashing_embeddings, create_openai
+    from clients import CLIENTS, create_bedrock, create_chat_openai, create_hashing_embeddings, create_openai
+
+    # Imports and the first shared build are paid once, keep them out of the numbers
+    per_question(args.model)
+    shared(args.model)
+
+    print(f"per question clients: {measure(per_question, args.model, args.questions):.2f}ms per question")
+    print(f"shared clients:       {measure(shared, args.model, args.questions):.3f}ms per question")
+    print(f"registry: {CLIENTS.stats()}")
+    stubs.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Load test of server.py against the local stubs.
+#   python bench/load_test.py --mode async --sessions 20 --questions 200 --concurrency 50
+# Both server modes are tested by default, the exit status is 1 when a question failed.
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stubs import COUNTERS, StubEnvironment
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS = ["How many pods are running?", "List the alarms", "Which pods are pending?",
+             "Show the hosts", "What is the kubernetes version?"]
+
+
+def wait_for_port(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Server did not open port {port} in {timeout} seconds")
+
+
+def wait_for_ready(port, timeout):
+    # Background startups open the port before they can answer
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = requests.get(f"http://127.0.0.1:{port}/ready", timeout=5)
+            if response.status_code == 200:
+                return
+            if response.json().get("state") == "failed":
+                raise RuntimeError(f"Server failed to start: {response.json().get('error')}")
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server was not ready in {timeout} seconds")
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def start_server(args, stubs):
+    env = dict(os.environ, **stubs.environment(), SERVER_MODE=args.mode, SERVER_PORT=str(args.port),
+               MAX_INFLIGHT_REQUESTS=str(args.max_inflight), LLM_MAX_CONCURRENCY=str(args.llm_concurrency))
+    log = open(args.server_log, "w")
+    server = subprocess.Popen([sys.executable, "server.py"], cwd=os.path.join(ROOT, "src"), env=env,
+                              stdout=log, stderr=log)
+    wait_for_port(args.port, args.startup_timeout)
+    wait_for_ready(args.port, args.startup_timeout)
+    return server
+
+
+def run(args):
+    stubs = StubEnvironment(llm_latency=args.llm_latency, cluster_latency=args.cluster_latency)
+    server = start_server(args, stubs)
+    base_url = f"http://127.0.0.1:{args.port}"
+    http = requests.Session()
+    http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+    try:
+        def create_session(_):
+            response = http.get(f"{base_url}/session", headers={"model": args.model, "temperature": "0.5"})
+            response.raise_for_status()
+            return response.text
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            sessions = list(executor.map(create_session, range(args.sessions)))
+        COUNTERS.reset()
+
+        def ask(index):
+            start = time.perf_counter()
+            response = http.post(f"{base_url}/chat", json={"message": QUESTIONS[index % len(QUESTIONS)],
+                                                           "session_id": sessions[index % len(sessions)]})
+            return response.status_code, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(ask, range(args.questions)))
+        elapsed = time.perf_counter() - start
+        metrics = http.get(f"{base_url}/metrics").text if args.metrics else None
+    finally:
+        server.terminate()
+        server.wait()
+        stubs.close()
+
+    latencies = [latency for status, latency in results if status == 200]
+    rejected = sum(1 for status, _ in results if status == 429)
+    failed = len(results) - len(latencies) - rejected
+    print(f"mode={args.mode} questions={len(results)} concurrency={args.concurrency} elapsed={elapsed:.2f}s")
+    print(f"ok={len(latencies)} rejected(429)={rejected} failed={failed} throughput={len(latencies) / elapsed:.1f} q/s")
+    print(f"latency p50={percentile(latencies, 0.5):.3f}s p95={percentile(latencies, 0.95):.3f}s "
+          f"max={max(latencies, default=0):.3f}s")
+    print(f"stub calls: {COUNTERS.snapshot()}")
+    if metrics is not None:
+        print(metrics, end="")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load against server.py with stub LLM and cluster")
+    parser.add_argument("--mode", choices=["dev", "async", "both"], default="both")
+    parser.add_argument("--port", type=int, default=2000)
+    parser.add_argument("--model", default="anthropic.claude-v2")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--cluster-latency", type=float, default=0.0)
+    parser.add_argument("--max-inflight", type=int, default=64)
+    parser.add_argument("--llm-concurrency", type=int, default=16)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--server-log", default=os.devnull, help="File receiving the server output")
+    parser.add_argument("--metrics", action="store_true", help="Print /metrics of the server after the run")
+    args = parser.parse_args()
+
+    # Sessions are created concurrently in each mode, the threaded dev server races differently than gevent
+    modes = ["dev", "async"] if args.mode == "both" else [args.mode]
+    failed = sum(run(argparse.Namespace(**dict(vars(args), mode=mode))) for mode in modes)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,222 @@
+# Replays a query corpus against the stubs and reports latency, throughput, LLM calls and memory.
+#   python bench/replay.py --target server --sessions 10 --repeat 5 --output results.json
+#   python bench/replay.py --target inprocess --baseline results.json
+# Exits with status 1 when --baseline is given and a metric got worse than --tolerance allows.
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from load_test import ROOT, percentile, start_server
+from stubs import COUNTERS, StubEnvironment
+
+LLM_COUNTERS = ("bedrock_invoke", "openai_chat")
+
+# Metrics compared to the baseline, all of them are better when lower
+REGRESSION_METRICS = ("p95", "p99", "llm_calls_per_question", "memory_per_session")
+
+
+def load_corpus(path):
+    # One JSON object per line with "query", "message" or "title" (a requests.jsonl style backlog)
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                queries.append(item)
+            else:
+                queries.append(item.get("query") or item.get("message") or item["title"])
+    return queries
+
+
+def rss_bytes(pid="self"):
+    # Resident memory from procfs, None where it is not available
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class ServerTarget():
+
+    def __init__(self, args, stubs):
+        self.server = start_server(args, stubs)
+        self.base_url = f"http://127.0.0.1:{args.port}"
+        self.http = requests.Session()
+        self.http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+        self.model = args.model
+
+    def new_session(self):
+        response = self.http.get(f"{self.base_url}/session", headers={"model": self.model, "temperature": "0.5"})
+        response.raise_for_status()
+        return response.text
+
+    def ask(self, session, query):
+        response = self.http.post(f"{self.base_url}/chat", json={"message": query, "session_id": session})
+        response.raise_for_status()
+        return response.text
+
+    def rss(self):
+        return rss_bytes(self.server.pid)
+
+    def close(self):
+        self.server.terminate()
+        self.server.wait()
+
+
+class InProcessTarget():
+    # Calls app.ask directly, without Flask and HTTP in the way
+
+    def __init__(self, args, stubs):
+        os.environ.update(stubs.environment())
+        os.chdir(os.path.join(ROOT, "src"))
+        sys.path.insert(0, os.path.join(ROOT, "src"))
+        import app
+        self.app = app
+        app.set_openai_key()
+        app.initiate_sessions()
+        self.model = args.model
+
+    def new_session(self):
+        return self.app.new_session(self.model, "0.5")
+
+    def ask(self, session, query):
+        with session['lock']:
+            return self.app.ask(query, session)
+
+    def rss(self):
+        return rss_bytes()
+
+    def close(self):
+        pass
+
+
+def replay(args):
+    queries = load_corpus(args.corpus) * args.repeat
+    stubs = StubEnvironment(llm_latency=args.llm_latency, cluster_latency=args.cluster_latency)
+    target = (ServerTarget if args.target == "server" else InProcessTarget)(args, stubs)
+
+    try:
+        # Lazy imports, clients and caches are paid once per process, not per session
+        target.ask(target.new_session(), queries[0])
+        rss_start = target.rss()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            sessions = list(executor.map(lambda _: target.new_session(), range(args.sessions)))
+        COUNTERS.reset()
+
+        def ask(index):
+            # Questions of a session are sent in order, as a user would
+            latencies = []
+            for position in range(index, len(queries), args.sessions):
+                start = time.perf_counter()
+                try:
+                    target.ask(sessions[index], queries[position])
+                except Exception as e:
+                    print(f"Question failed: {queries[position]}: {e}", file=sys.stderr)
+                    latencies.append(None)
+                    continue
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(args.concurrency, args.sessions)) as executor:
+            results = [latency for latencies in executor.map(ask, range(args.sessions)) for latency in latencies]
+        elapsed = time.perf_counter() - start
+        rss_end = target.rss()
+        calls = COUNTERS.snapshot()
+    finally:
+        target.close()
+        stubs.close()
+
+    latencies = [latency for latency in results if latency is not None]
+    llm_calls = sum(calls.get(name, 0) for name in LLM_COUNTERS)
+    cluster_calls = sum(count for name, count in calls.items() if name.startswith("cluster_"))
+    memory = rss_end - rss_start if rss_start is not None and rss_end is not None else None
+    return {
+        "target": args.target,
+        "questions": len(results),
+        "failed": len(results) - len(latencies),
+        "sessions": args.sessions,
+        "elapsed": elapsed,
+        "qps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "llm_calls_per_question": llm_calls / len(results) if results else 0.0,
+        "cluster_calls_per_question": cluster_calls / len(results) if results else 0.0,
+        "memory_per_session": memory / args.sessions if memory is not None else None,
+        "stub_calls": calls,
+    }
+
+
+def report(result):
+    print(f"target={result['target']} questions={result['questions']} failed={result['failed']} "
+          f"sessions={result['sessions']} elapsed={result['elapsed']:.2f}s qps={result['qps']:.1f}")
+    print(f"latency p50={result['p50']:.3f}s p95={result['p95']:.3f}s p99={result['p99']:.3f}s")
+    print(f"llm calls/question={result['llm_calls_per_question']:.2f} "
+          f"cluster calls/question={result['cluster_calls_per_question']:.2f}")
+    if result['memory_per_session'] is not None:
+        print(f"memory growth/session={result['memory_per_session'] / 1024:.0f}KiB")
+    print(f"stub calls: {result['stub_calls']}")
+
+
+def regressions(result, baseline, tolerance):
+    if baseline.get("target") != result["target"]:
+        print(f"Baseline was measured on the {baseline.get('target')} target, not on {result['target']}",
+              file=sys.stderr)
+    found = []
+    for metric in REGRESSION_METRICS:
+        current, previous = result.get(metric), baseline.get(metric)
+        if current is None or not previous:
+            continue
+        if current > previous * (1 + tolerance):
+            found.append(f"{metric}: {previous:.4g} -> {current:.4g} (+{(current / previous - 1) * 100:.0f}%)")
+    if result["failed"] > baseline.get("failed", 0):
+        found.append(f"failed: {baseline.get('failed', 0)} -> {result['failed']}")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a query corpus against stub LLMs and cluster")
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "bench", "queries.jsonl"))
+    parser.add_argument("--target", choices=["server", "inprocess"], default="server")
+    parser.add_argument("--repeat", type=int, default=3, help="Times the corpus is replayed")
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--mode", choices=["dev", "async"], default="async")
+    parser.add_argument("--port", type=int, default=2000)
+    parser.add_argument("--model", default="anthropic.claude-v2")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--cluster-latency", type=float, default=0.0)
+    parser.add_argument("--max-inflight", type=int, default=64)
+    parser.add_argument("--llm-concurrency", type=int, default=16)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--server-log", default=os.devnull, help="File receiving the server output")
+    parser.add_argument("--output", help="Write the results as JSON, to be used as a later baseline")
+    parser.add_argument("--baseline", help="Results JSON of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative increase of a metric")
+    args = parser.parse_args()
+
+    result = replay(args)
+    report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,119 @@
+# Cold start of the chatbot: module import time, time to open the port and time to be ready.
+#   python bench/startup.py --output startup.json
+#   python bench/startup.py --baseline startup.json
+# Exits with status 1 when --baseline is given and a duration got worse than --tolerance allows.
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import requests
+
+from load_test import ROOT, wait_for_port
+from stubs import StubEnvironment
+
+SRC = os.path.join(ROOT, "src")
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+\d+\s+\|\s+(\d+)\s+\|\s?(\S.*)$")
+
+
+def import_time(module, env):
+    # Cumulative microseconds of the module import, from a fresh interpreter
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=SRC, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    for line in output.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match and match.group(2) == module:
+            return int(match.group(1)) / 1e6
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def server_startup(mode, startup_mode, port, env, timeout):
+    # Seconds until the port is open, until /ready answers 200 and until the first question is answered
+    env = dict(env, SERVER_MODE=mode, SERVER_PORT=str(port), STARTUP_MODE=startup_mode)
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "server.py"], cwd=SRC, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, timeout)
+        port_open = time.perf_counter() - start
+
+        base_url = f"http://127.0.0.1:{port}"
+        while True:
+            response = requests.get(f"{base_url}/ready", timeout=timeout)
+            if response.status_code == 200:
+                break
+            if response.json().get("state") == "failed" or time.perf_counter() - start > timeout:
+                raise RuntimeError(f"Server did not get ready: {response.text}")
+            time.sleep(0.05)
+        ready = time.perf_counter() - start
+
+        session = requests.get(f"{base_url}/session", headers={"model": "anthropic.claude-v2", "temperature": "0.5"})
+        session.raise_for_status()
+        requests.post(f"{base_url}/chat", json={"message": "List the alarms", "session_id": session.text}).raise_for_status()
+        first_answer = time.perf_counter() - start
+        return {"port_open": port_open, "ready": ready, "first_answer": first_answer,
+                "stages": response.json()["stages"]}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def measure(args):
+    stubs = StubEnvironment()
+    env = dict(os.environ, **stubs.environment())
+    results = {}
+    try:
+        for module in ("server", "app"):
+            results[f"import_{module}"] = min(import_time(module, env) for _ in range(args.runs))
+        for startup_mode in ("eager", "background"):
+            runs = [server_startup(args.mode, startup_mode, args.port, env, args.timeout) for _ in range(args.runs)]
+            for metric in ("port_open", "ready", "first_answer"):
+                results[f"{startup_mode}_{metric}"] = min(run[metric] for run in runs)
+            results[f"{startup_mode}_stages"] = runs[-1]["stages"]
+    finally:
+        stubs.close()
+    return results
+
+
+def regressions(result, baseline, tolerance):
+    found = []
+    for metric, current in result.items():
+        previous = baseline.get(metric)
+        if not isinstance(current, float) or not previous:
+            continue
+        if current > previous * (1 + tolerance):
+            found.append(f"{metric}: {previous:.3f}s -> {current:.3f}s (+{(current / previous - 1) * 100:.0f}%)")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time and startup time of server.py against the stubs")
+    parser.add_argument("--mode", choices=["dev", "async"], default="async")
+    parser.add_argument("--port", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=3, help="Best of this many runs is reported")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="Write the results as JSON, to be used as a later baseline")
+    parser.add_argument("--baseline", help="Results JSON of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative increase of a duration")
+    args = parser.parse_args()
+
+    result = measure(args)
+    for metric, value in result.items():
+        if isinstance(value, float):
+            print(f"{metric}: {value:.3f}s")
+        else:
+            print(f"{metric}: " + ", ".join(f"{stage}={duration * 1000:.0f}ms" for stage, duration in value.items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if found else 0)
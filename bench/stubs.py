@@ -0,0 +1,256 @@
+# Local stand-ins for OpenAI, Bedrock, Keystone, the Wind River APIs and the Kubernetes API.
+# Answers are canned and deterministic so the chatbot can be exercised without any cloud access.
+import datetime
+import hashlib
+import json
+import os
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIMENSIONS = 256
+
+# Wind River services by port, keystone is reached through the OAM URL port
+WR_PORTS = (18002, 6385, 8119, 15491, 7777)
+KEYSTONE_PORT = 5000
+K8S_PORT = 6443
+
+# Question keyword -> kind of the documents that answer it
+ANSWER_KINDS = (("version", "version"), ("pod", "pods"), ("alarm", "alarms"), ("host", "ihosts"),
+                ("subcloud", "subclouds"))
+
+
+class Counters():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def increment(self, name):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+
+COUNTERS = Counters()
+
+
+def route_answer(prompt):
+    # Canned answers for each routing prompt of the chatbot
+    if "choses a node" in prompt:
+        return "name: System Controller"
+    if "API generator" in prompt and "kubernetes cluster" in prompt:
+        return "api: /version" if re.search(r"kubernetes version|version of kubernetes", prompt.lower()) \
+            else "api: /api/v1/pods"
+    if "API generator" in prompt and "Wind River cluster" in prompt:
+        question = prompt.rsplit("Question:", 1)[-1].lower()
+        if "subcloud" in question:
+            return "api: 8119/v1.0/subclouds"
+        if "host" in question:
+            return "api: 18002/v1/ihosts"
+        return "api: 18002/v1/alarms"
+    if "'positive' if there is information" in prompt:
+        return os.environ.get("STUB_GRADE", "negative")
+    if "choose between Wind River APIs and Kubernetes APIs" in prompt:
+        query = prompt.rsplit("User query:", 1)[-1].lower()
+        return "Wind River" if re.search(r"alarm|host|certificate|subcloud|patch", query) else "Kubernetes"
+    if "Standalone question:" in prompt:
+        return prompt.rsplit("Follow Up Input:", 1)[-1].split("Standalone question:")[0].strip()
+    # Final answers only have data once documents of the kind asked about were retrieved as context
+    question = prompt.rsplit("Question:", 1)[-1].lower()
+    for keyword, kind in ANSWER_KINDS:
+        if keyword in question and f"{kind} from " in prompt:
+            return f"According to the {kind} data there are 3 items and 2 of them need attention."
+    return "I'm sorry, I don't know."
+
+
+def embed(text):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [((digest[index % len(digest)] + index) % 255) / 255.0 - 0.5 for index in range(EMBEDDING_DIMENSIONS)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OpenAIHandler(StubHandler):
+
+    def do_POST(self):
+        data = self.read_json()
+        time.sleep(self.latency)
+
+        if self.path.endswith("/embeddings"):
+            COUNTERS.increment("openai_embeddings")
+            inputs = data["input"] if isinstance(data["input"], list) else [data["input"]]
+            vectors = [{"object": "embedding", "index": index, "embedding": embed(json.dumps(item))}
+                       for index, item in enumerate(inputs)]
+            return self.send_json(200, {"object": "list", "data": vectors, "model": data.get("model"),
+                                        "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+        COUNTERS.increment("openai_chat")
+        prompt = "\n".join(message["content"] for message in data.get("messages", []))
+        answer = route_answer(prompt)
+        self.send_json(200, {"id": "stub", "object": "chat.completion", "created": int(time.time()),
+                             "model": data.get("model"),
+                             "choices": [{"index": 0, "finish_reason": "stop",
+                                          "message": {"role": "assistant", "content": answer}}],
+                             "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(answer) // 4,
+                                       "total_tokens": (len(prompt) + len(answer)) // 4}})
+
+
+class BedrockHandler(StubHandler):
+
+    def do_POST(self):
+        data = self.read_json()
+        time.sleep(self.latency)
+        COUNTERS.increment("bedrock_invoke")
+
+        model_id = self.path.split("/")[2]
+        answer = route_answer(data.get("prompt") or data.get("inputText", ""))
+        if model_id.startswith("amazon"):
+            return self.send_json(200, {"results": [{"outputText": answer}]})
+        self.send_json(200, {"completion": answer, "stop_reason": "stop_sequence"})
+
+
+class ClusterHandler(StubHandler):
+    # Keystone, Wind River and Kubernetes endpoints, told apart by the listening port
+    pods = 50
+    alarms = 10
+
+    def do_POST(self):
+        if self.server.server_port == KEYSTONE_PORT and self.path == "/v3/auth/tokens":
+            COUNTERS.increment("keystone_token")
+            self.read_json()
+            expires_at = (datetime.datetime.utcnow() + datetime.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.000000Z")
+            return self.send_json(201, {"token": {"expires_at": expires_at}}, {"X-Subject-Token": "stub-token"})
+        self.send_json(404, {"error": "not found"})
+
+    def do_GET(self):
+        COUNTERS.increment(f"cluster_{self.server.server_port}")
+        path = self.path.split("?", 1)[0]
+
+        if self.server.server_port == K8S_PORT:
+            if path == "/version":
+                return self.send_json(200, {"major": "1", "minor": "28", "gitVersion": "v1.28.4"})
+            if path.endswith("/pods"):
+                pods = [{"metadata": {"name": f"app-{index}", "namespace": "default", "uid": f"uid-{index}",
+                                      "annotations": {"stub": "x" * 64}, "managedFields": [{"manager": "kubelet"}]},
+                         "spec": {"nodeName": "controller-0"},
+                         "status": {"phase": "Running" if index % 7 else "Pending",
+                                    "containerStatuses": [{"name": "app", "ready": bool(index % 7),
+                                                           "restartCount": index % 3, "state": {"running": {}}}]}}
+                        for index in range(self.pods)]
+                return self.send_json(200, {"kind": "PodList", "metadata": {}, "items": pods})
+            return self.send_json(200, {"kind": "List", "metadata": {}, "items": []})
+
+        if path == "/v1/alarms":
+            alarms = [{"alarm_id": f"100.{100 + index}", "severity": "critical" if index % 4 == 0 else "major",
+                       "reason_text": f"Stub alarm {index}", "entity_instance_id": "host=controller-0",
+                       "uuid": f"alarm-{index}"} for index in range(self.alarms)]
+            return self.send_json(200, {"alarms": alarms})
+        if path == "/v1/ihosts":
+            return self.send_json(200, {"ihosts": [{"hostname": "controller-0", "personality": "controller",
+                                                    "administrative": "unlocked", "operational": "enabled",
+                                                    "availability": "available"}]})
+        if path == "/v1.0/subclouds":
+            return self.send_json(200, {"subclouds": []})
+        self.send_json(200, {"items": []})
+
+
+def self_signed_context(directory):
+    # The chatbot always talks https to the Kubernetes API
+    cert = os.path.join(directory, "stub.crt")
+    key = os.path.join(directory, "stub.key")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-subj", "/CN=127.0.0.1",
+                    "-days", "1", "-keyout", key, "-out", cert], check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def serve(handler, port, context=None):
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    if context is not None:
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StubEnvironment():
+    # Starts every stub and provides the environment variables pointing the chatbot to them
+
+    def __init__(self, llm_latency=0.0, cluster_latency=0.0, pods=50, alarms=10):
+        self.directory = tempfile.mkdtemp(prefix="chatbot-stubs-")
+        self.servers = []
+
+        openai_handler = type("OpenAI", (OpenAIHandler,), {"latency": llm_latency})
+        bedrock_handler = type("Bedrock", (BedrockHandler,), {"latency": llm_latency})
+        cluster_handler = type("Cluster", (ClusterHandler,), {"latency": cluster_latency, "pods": pods,
+                                                              "alarms": alarms})
+
+        self.openai = serve(openai_handler, 0)
+        self.bedrock = serve(bedrock_handler, 0)
+        self.servers += [self.openai, self.bedrock]
+
+        context = self_signed_context(self.directory)
+        for port in (KEYSTONE_PORT,) + WR_PORTS:
+            self.servers.append(serve(cluster_handler, port))
+        self.servers.append(serve(cluster_handler, K8S_PORT, context))
+
+    def environment(self):
+        # Bedrock client reads the profile from these files, credentials are never checked
+        credentials = os.path.join(self.directory, "credentials")
+        with open(credentials, "w") as f:
+            f.write("[windriver-poc-user]\naws_access_key_id = stub\naws_secret_access_key = stub\n")
+
+        openai_url = f"http://127.0.0.1:{self.openai.server_port}/v1"
+        return {
+            "OPENAI_API_KEY": "stub-key",
+            "OPENAI_BASE_URL": openai_url,
+            "OPENAI_API_BASE": openai_url,
+            "BEDROCK_ENDPOINT_URL": f"http://127.0.0.1:{self.bedrock.server_port}",
+            "BEDROCK_STREAMING": "false",
+            "AWS_SHARED_CREDENTIALS_FILE": credentials,
+            "AWS_CONFIG_FILE": credentials,
+            "OAM_IP": f"http://127.0.0.1:{KEYSTONE_PORT}",
+            "TOKEN": "stub-k8s-token",
+            "WR_USER": "admin",
+            "WR_PASSWORD": "stub",
+            "EMBEDDINGS_PROVIDER": "hashing",
+            "NO_PROXY": "127.0.0.1,localhost",
+        }
+
+    def close(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,83 @@
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+from constants import LOG
+
+CATALOG_PATH = os.environ.get('WR_APIS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), "wr_apis.json"))
+
+ApiEntry = namedtuple("ApiEntry", ["url", "port", "method", "action", "central_only"])
+
+# Words that carry no routing information
+STOPWORDS = {"a", "all", "an", "and", "any", "are", "about", "be", "each", "for", "from", "given",
+             "in", "information", "is", "it", "list", "lists", "of", "on", "only", "or", "other",
+             "should", "such", "that", "the", "them", "this", "to", "used", "user", "wants",
+             "when", "will", "with"}
+
+CENTRAL_ONLY_PATTERN = re.compile(r"only be used in the central cloud", re.IGNORECASE)
+
+
+def normalize(word):
+    # Naive singular form so "alarms" and "alarm" share the same key
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [normalize(word) for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+
+class ApiCatalog():
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+
+        # Prompt text is the same for every request to the same kind of instance
+        self.rendered = {}
+
+    @classmethod
+    def from_file(cls, path=CATALOG_PATH):
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        entries = []
+        for api in data["APIs"]:
+            url = api["url"].lstrip("/")
+            port = url.split("/", 1)[0]
+            central_only = api.get("central_only", bool(CENTRAL_ONLY_PATTERN.search(api["action"])))
+            entries.append(ApiEntry(url, port, api.get("method", "GET"), api["action"], central_only))
+
+        LOG.info(f"Loaded {len(entries)} Wind River APIs from {path}")
+        return cls(entries)
+
+    def for_instance(self, instance_type):
+        # Subclouds can't answer central cloud APIs, don't offer them to the LLM
+        if instance_type == "central cloud":
+            return self.entries
+        return tuple(entry for entry in self.entries if not entry.central_only)
+
+    def render(self, entries):
+        return "\n".join(f"{entry.method} {entry.url}: {entry.action}" for entry in entries)
+
+    def prompt_context(self, instance_type):
+        context = self.rendered.get(instance_type)
+        if context is None:
+            context = self.render(self.for_instance(instance_type))
+            self.rendered[instance_type] = context
+        return context
+
+
+catalog = None
+catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    global catalog
+    if catalog is None:
+        with catalog_lock:
+            if catalog is None:
+                catalog = ApiCatalog.from_file()
+    return catalog
@@ -1,12 +1,53 @@
 import sys
+import time
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
-from constants import CLIENT_ERROR_MSG, LOG
-import requests
+from constants import CLIENT_ERROR_MSG, ENDPOINT_TOP_K, K8S_PAGE_LIMIT, LOG
+from token_cache import TOKEN_CACHE, TokenError
+from api_catalog import get_catalog
+from retriever import get_retriever
+from http_pool import HTTP_POOL
+from chunker import NOISY_FIELDS, parse_payload
+from limits import LLM_LIMITER
+from clients import CLIENTS
+from snapshot_cache import SNAPSHOT_CACHE, snapshot_age
+from tracing import annotate, approx_tokens, span
 import re
 import os
+from urllib.parse import urlsplit
+
+# Collection paths: /api/v1/pods, /api/v1/namespaces/<ns>/pods, /apis/apps/v1/deployments
+K8S_LIST_PATTERN = re.compile(r"^/(api/v1|apis/[^/]+/[^/]+)/(namespaces/[^/]+/)?([a-z]+)/?$")
+
+K8S_NAMESPACED_RESOURCES = {"pods", "services", "endpoints", "events", "configmaps", "secrets",
+                            "serviceaccounts", "persistentvolumeclaims", "deployments", "replicasets",
+                            "statefulsets", "daemonsets", "jobs", "cronjobs", "ingresses"}
+
+# Pods are the largest lists, only what describes their health is kept. Other kinds only lose bookkeeping
+POD_SPEC_FIELDS = ("nodeName",)
+POD_STATUS_FIELDS = ("phase", "reason", "message")
+
+# Parsed payloads are indexed from the JSON, their text only goes to logs and fan-out summaries
+RESPONSE_PREVIEW_CHARS = 1000
+
+
+def preview(payload):
+    # Slices lists before rendering them, a list of thousands of objects is never made one string
+    if isinstance(payload, list):
+        return f"{len(payload)} items: {str(payload[:10])[:RESPONSE_PREVIEW_CHARS]}"
+    if isinstance(payload, dict):
+        # Wind River lists come wrapped: {"alarms": [...]}
+        fields = ", ".join(f"{key!r}: {preview(value)}" for key, value in list(payload.items())[:20])
+        return "{" + fields[:RESPONSE_PREVIEW_CHARS] + "}"
+    return str(payload)[:RESPONSE_PREVIEW_CHARS]
+
+
+def freshness(snapshot):
+    # Cached responses tell the answer how old the data is
+    fetched = time.strftime("%H:%M:%S UTC", time.gmtime(snapshot.fetched_at))
+    return f"(snapshot taken at {fetched}, {snapshot_age(snapshot):.0f}s ago)"
+
 
 class k8s_request():
 
@@ -40,9 +81,18 @@ class k8s_request():
         # User query
         self.query = user_query
 
+        # Filled once the API is requested
+        self.endpoint_path = None
+        self.status_code = None
+        self.payload = None
+        self.raw_bytes = None
+        self.fetched_at = None
 
-    def get_endpoint(self):
-        completion = self.get_api_completion()
+
+    def get_endpoint(self, completion=None):
+        # Completion may come from a previous routing decision, skipping the LLM
+        if completion is None:
+            completion = self.get_api_completion()
         if completion[0] == "/":
             api_endpoint = f'{self.api_server_url}{completion}'
         elif completion == "-1":
@@ -54,11 +104,12 @@ class k8s_request():
         if "version" in api_endpoint:
             api_endpoint = f"{self.api_server_url}/version"
 
+        self.endpoint_path = api_endpoint[len(self.api_server_url):]
         return api_endpoint
 
     def get_api_completion(self):
         # Initiate OpenAI
-        llm = ChatOpenAI(openai_api_key = self.api_key)
+        llm = CLIENTS.get("chat_openai", api_key=self.api_key)
 
         # Expected llm response format
         format_response = "api: <api_completion>"
@@ -73,7 +124,9 @@ class k8s_request():
         chain = prompt | llm | output_parser
 
         # Get completion
-        completion = chain.invoke({"input": self.query})
+        with LLM_LIMITER.slot():
+            completion = chain.invoke({"input": self.query})
+        annotate(approx_tokens=approx_tokens(self.query) + approx_tokens(completion))
         if len(completion.split(":")) > 1:
             clean_completion = completion.split(":")[1].strip()
         else:
@@ -82,46 +135,154 @@ class k8s_request():
         return clean_completion
 
     def filter_response(self, response):
-        if response.json().get('items', []) != []:
-            pods = response.json().get('items', [])
+        data = response.json()
+        if isinstance(data, dict) and data.get('items', []) != []:
+            pods = data.get('items', [])
             try:
                 filtered_pods = [
                     pod for pod in pods if pod['metadata']['namespace'] not in self.excluded_namespaces]
                 return filtered_pods
             except:
-                return response.json()
+                return data
         else:
-            return response.json()
-
-    def get_API_response(self):
+            return data
+
+    def is_list_endpoint(self, api_endpoint):
+        path = urlsplit(api_endpoint).path
+        return K8S_LIST_PATTERN.match(path) is not None
+
+    def namespace_selector(self, api_endpoint):
+        # Only namespaced resources listed across all namespaces support the namespace field selector
+        match = K8S_LIST_PATTERN.match(urlsplit(api_endpoint).path)
+        if match.group(2) is not None or match.group(3) not in K8S_NAMESPACED_RESOURCES:
+            return None
+        return ",".join(f"metadata.namespace!={namespace}" for namespace in self.excluded_namespaces)
+
+    def list_resources(self, api_endpoint, headers):
+        # Follows the limit/continue pagination, each page is parsed once and trimmed right away.
+        # Returns the last response, the items and the bytes of every page
+        query = urlsplit(api_endpoint).query
+        params = {}
+        if "limit=" not in query:
+            params["limit"] = K8S_PAGE_LIMIT
+        selector = self.namespace_selector(api_endpoint)
+        if selector and "fieldSelector=" not in query:
+            params["fieldSelector"] = selector
+
+        resource = K8S_LIST_PATTERN.match(urlsplit(api_endpoint).path).group(3)
+        items = []
+        size = 0
+        while True:
+            response = HTTP_POOL.get(api_endpoint, headers=headers, params=params)
+            if response.status_code == 400 and "fieldSelector" in params:
+                # Selector not supported by this resource, start over and filter locally
+                LOG.info(f"Field selector not supported by {api_endpoint}")
+                del params["fieldSelector"]
+                params.pop("continue", None)
+                items = []
+                size = 0
+                continue
+            if response.status_code != 200:
+                return response, None, size
+
+            size += len(response.content)
+            page = response.json()
+            for item in page.get("items") or []:
+                if item.get("metadata", {}).get("namespace") in self.excluded_namespaces:
+                    continue
+                items.append(self.trim_item(item, resource))
+
+            token = (page.get("metadata") or {}).get("continue")
+            if not token:
+                return response, items, size
+            params["continue"] = token
+
+    def trim_item(self, item, resource):
+        # Keep only the fields relevant to answer about the object
+        metadata = item.get("metadata", {})
+        if resource != "pods":
+            trimmed = {key: value for key, value in item.items() if key not in NOISY_FIELDS}
+            trimmed["metadata"] = {key: value for key, value in metadata.items() if key not in NOISY_FIELDS}
+            status = item.get("status")
+            if isinstance(status, dict) and "images" in status:
+                # Nodes list every image they ever pulled
+                trimmed["status"] = {key: value for key, value in status.items() if key != "images"}
+            return trimmed
+
+        spec = item.get("spec") or {}
+        status = item.get("status") or {}
+
+        trimmed = {"metadata": {key: metadata[key] for key in ("name", "namespace") if key in metadata}}
+
+        trimmed_spec = {key: spec[key] for key in POD_SPEC_FIELDS if key in spec}
+        if trimmed_spec:
+            trimmed["spec"] = trimmed_spec
+
+        trimmed_status = {key: status[key] for key in POD_STATUS_FIELDS if key in status}
+        if "containerStatuses" in status:
+            trimmed_status["containerStatuses"] = [
+                {"name": container.get("name"),
+                 "ready": container.get("ready"),
+                 "restartCount": container.get("restartCount", 0),
+                 "state": container.get("state")}
+                for container in status["containerStatuses"] or []]
+        ready = [condition for condition in status.get("conditions") or [] if condition.get("type") == "Ready"]
+        if ready:
+            trimmed_status["conditions"] = [{"type": "Ready", "status": ready[0].get("status")}]
+        if trimmed_status:
+            trimmed["status"] = trimmed_status
+
+        return trimmed
+
+    def get_API_response(self, completion=None):
         # Define Kubernetes API endpoint
-        api_endpoint = self.get_endpoint()
+        api_endpoint = self.get_endpoint(completion)
         if api_endpoint == "-1":
             return CLIENT_ERROR_MSG
 
-        # Define headers with Authorization
-        headers = {'Authorization': f'Bearer {self.k8s_token}'}
-
-        # API request
+        # API request, shared with other sessions asking the same endpoint while it is fresh
         try:
             print(f'API address: {api_endpoint}', file=sys.stderr)
             LOG.info(f'API address: {api_endpoint}')
-            response = requests.get(api_endpoint, headers=headers, verify=False)
+            snapshot = SNAPSHOT_CACHE.get(self.name, api_endpoint, lambda: self.fetch(api_endpoint))
+            self.status_code = snapshot.status_code
         except Exception as e:
             error = f"An error ocurred while trying to retrieve the information, please rewrite the question and try again.\n Error: {e}"
             LOG.warning(error)
             return error
 
-        if response.status_code == 200:
-            # Filter response for undesired namespaces
-            filtered_response = self.filter_response(response)
-            buit_text_response = f"API {api_endpoint} response from {self.name} = {filtered_response}"
+        if snapshot.status_code == 200:
+            self.payload = snapshot.payload
+            self.raw_bytes = snapshot.raw_bytes
+            self.fetched_at = snapshot.fetched_at
+            buit_text_response = f"API {api_endpoint} response from {self.name} {freshness(snapshot)} = {preview(snapshot.payload)}"
             return buit_text_response
         else:
-            error = f"Error trying to make API request:\n {response.status_code}, {response.text}"
+            error = f"Error trying to make API request:\n {snapshot.status_code}, {snapshot.text}"
             LOG.warning(error)
             return error
 
+    def fetch(self, api_endpoint):
+        # Define headers with Authorization
+        headers = {'Authorization': f'Bearer {self.k8s_token}'}
+
+        with span("cluster_http", instance=self.name) as http:
+            if self.is_list_endpoint(api_endpoint):
+                response, items, size = self.list_resources(api_endpoint, headers)
+                http.set(status=response.status_code, items=len(items) if items is not None else None, bytes=size)
+            else:
+                response, items = HTTP_POOL.get(api_endpoint, headers=headers), None
+                size = len(response.content)
+                http.set(status=response.status_code, bytes=size)
+
+        if response.status_code != 200:
+            return response.status_code, None, response.text, size
+
+        # Filter response for undesired namespaces
+        if items is None:
+            items = self.filter_response(response)
+        return response.status_code, items, None, size
+
 
 class wr_request():
 
@@ -130,6 +291,7 @@ class wr_request():
         self.auth_url = instance['URL']
         self.user = os.environ['WR_USER']
         self.password = os.environ['WR_PASSWORD']
+        self.project = os.environ.get('WR_PROJECT', 'admin')
         self.name = instance['name']
         self.type = instance['type']
 
@@ -138,8 +300,8 @@ class wr_request():
         match = re.search(pattern, self.auth_url)
         self.api_server_url = match.group(0)
 
-        # Necessary token
-        self.token = self.get_token()
+        # Fetched by fetch(), responses served from the snapshot cache need no Keystone login
+        self.token = None
 
         # API key
         self.api_key = key
@@ -147,28 +309,42 @@ class wr_request():
         # User query
         self.query = user_query
 
-        # Embedded list of Wind River APIs
-        self.apis = self.load_embedded_apis()
+        # Filled once the API is requested
+        self.endpoint_path = None
+        self.status_code = None
+        self.payload = None
+        self.raw_bytes = None
+        self.fetched_at = None
 
 
     def load_embedded_apis(self):
-        with open ("wr_apis.json", "r") as f:
-            api_list = f.read()
-
-        return api_list
-
-
-    def get_endpoint(self):
-        completion = self.get_api_completion()
+        # Catalog is parsed once per process, only the APIs valid for this instance are used
+        catalog = get_catalog()
+        if ENDPOINT_TOP_K <= 0:
+            return catalog.prompt_context(self.type)
+
+        # Send to the LLM only the APIs closest to the user question
+        allowed = set(catalog.for_instance(self.type))
+        candidates = get_retriever().top_k(self.query, ENDPOINT_TOP_K, allowed=allowed)
+        return catalog.render(candidates)
+
+
+    def get_endpoint(self, completion=None):
+        # Completion may come from a previous routing decision, skipping the LLM
+        if completion is None:
+            completion = self.get_api_completion()
+        self.endpoint_path = completion
         api = self.api_server_url + completion
 
         return api
 
 
     def get_api_completion(self):
+        # Candidate APIs are only needed when the endpoint isn't known yet
+        apis = self.load_embedded_apis()
+
         # Initiate OpenAI
-        llm = ChatOpenAI(openai_api_key = self.api_key,
-                         temperature=0.4)
+        llm = CLIENTS.get("chat_openai", api_key=self.api_key, temperature=0.4)
 
         # Expected llm response format
         format_response = "api: <api_url>"
@@ -183,7 +359,9 @@ class wr_request():
         chain = prompt | llm | output_parser
 
         #Get completion
-        completion = chain.invoke({"context":self.apis, "question": self.query})
+        with LLM_LIMITER.slot():
+            completion = chain.invoke({"context":apis, "question": self.query})
+        annotate(approx_tokens=approx_tokens(apis) + approx_tokens(self.query) + approx_tokens(completion))
 
         #completion = response.choices[0].message.content
         clean_completion = completion.split(":")[1].strip()
@@ -191,74 +369,63 @@ class wr_request():
         return clean_completion
 
 
-    def get_API_response(self):
-        url = self.get_endpoint()
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "X-Auth-Token": self.token
-        }
-
+    def get_API_response(self, completion=None):
+        url = self.get_endpoint(completion)
 
         try:
             print(f'API address: {url}', file=sys.stderr)
             LOG.info(f'API address: {url}')
-            response = requests.get(url, headers=headers, verify=False)
+            snapshot = SNAPSHOT_CACHE.get(self.name, url, lambda: self.fetch(url))
+            self.status_code = snapshot.status_code
         except Exception as e:
             error = f"An error ocurred while trying to retrieve the information, please rewrite the question and try again.\n Error: {e}"
             LOG.warning(error)
             return error
 
-        if response.status_code == 200:
-            str_response = f"Wind River API response from {self.name} = {response.text}"
+        if snapshot.status_code == 200:
+            self.payload = snapshot.payload
+            self.raw_bytes = snapshot.raw_bytes
+            self.fetched_at = snapshot.fetched_at
+            # Responses that are not JSON are split and indexed from this text
+            body = snapshot.text if snapshot.payload is None else preview(snapshot.payload)
+            str_response = f"Wind River API response from {self.name} {freshness(snapshot)} = {body}"
             return str_response
         else:
-            error = f"Error trying to make API request:\n {response.status_code}, {response.text}"
+            error = f"Error trying to make API request:\n {snapshot.status_code}, {snapshot.text}"
             LOG.warning(error)
             return error
 
-
-
-    def get_token(self):
-        url = f"{self.auth_url}/v3/auth/tokens"
+    def fetch(self, url):
+        # Background refreshes may run long after this request was created, take the current token
+        self.token = self.get_token()
         headers = {
-            "Content-Type": "application/json"
-        }
-        data = {
-            "auth": {
-                "identity": {
-                    "methods": ["password"],
-                    "password": {
-                        "user": {
-                            "name": self.user,
-                            "domain": {"id": "default"},
-                            "password": self.password
-                        }
-                    }
-                },
-                "scope": {
-                    "project": {
-                        "name": "admin",
-                        "domain": {"id": "default"}
-                    }
-                }
-            }
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "X-Auth-Token": self.token
         }
+        with span("cluster_http", instance=self.name) as http:
+            response = HTTP_POOL.get(url, headers=headers)
 
-        try:
-            response = requests.post(url, headers=headers, json=data, verify=False)
-        except Exception as e:
-            error = f"An error ocurred while trying to retrieve the authentication for the Wind River APIs. Error:{e}"
-            LOG.error(error)
-            return error
+            # Token may have been revoked before its expiration, authenticate again once
+            if response.status_code == 401:
+                LOG.info(f"Token rejected by {self.name}, re-authenticating")
+                self.token = self.get_token(force_refresh=True)
+                headers["X-Auth-Token"] = self.token
+                response = HTTP_POOL.get(url, headers=headers)
+            http.set(status=response.status_code, bytes=len(response.content))
 
-        if response.status_code == 201:
-            # Get token from response
-            x_auth_token = response.headers["x-subject-token"]
+        if response.status_code != 200:
+            return response.status_code, None, response.text, len(response.content)
+        return response.status_code, parse_payload(response), response.text, len(response.content)
 
-            return x_auth_token
-        else:
-            error = f"Error trying to retrieve authentication token:\n {response.status_code}, {response.text}"
+
+    def get_token(self, force_refresh=False):
+        try:
+            # Tokens are shared per auth URL, user and project and refreshed before expiring
+            return TOKEN_CACHE.get_token(self.auth_url, self.user, self.password,
+                                         project=self.project, force_refresh=force_refresh)
+        except TokenError as e:
+            error = str(e)
             LOG.warning(error)
             return error
 
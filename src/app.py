@@ -4,53 +4,117 @@ import logging
 import os
 import re
 import sys
+import threading
+import time
 import uuid
-from langchain.text_splitter import CharacterTextSplitter
+from concurrent.futures import ThreadPoolExecutor
 from langchain.chains import ConversationalRetrievalChain
-from langchain_community.vectorstores import Chroma
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain.schema.document import Document
 from langchain.memory.buffer import ConversationBufferMemory
-from langchain_community.llms import Bedrock
 from api_request import k8s_request, wr_request
-import boto3
-from constants import CLIENT_ERROR_MSG, LOG
+from api_catalog import get_catalog
+from retriever import set_embeddings
+from routing_cache import ROUTING_CACHE
+from fast_router import get_fast_router
+from fanout import fan_out, fanout_targets, merge_results
+from session_index import SessionIndex
+from embedding_cache import cached, get_embedding_cache
+from chunker import batched
+from compaction import COMPACTOR
+from streaming import FINAL_ANSWER_TAG, TokenStreamHandler, notify
+from tracing import TRACER, annotate, approx_tokens, bind, span
+from limits import LLM_LIMITER, REQUEST_LIMITER
+from snapshot_cache import SNAPSHOT_CACHE
+from http_pool import HTTP_POOL
+from grader import AnswerGrader
+from speculation import SpeculativePrefetcher
+from session_manager import SessionManager
+from clients import CLIENTS, parse_llm_specs
+from constants import (CHUNK_BATCH_SIZE, CLIENT_ERROR_MSG, EMBEDDINGS_PROVIDER, LOG, RETRIEVER_K,
+                       ROUTING_WORKERS, WARM_LLMS)
+
+# Bounded pool running the independent routing LLM calls
+ROUTING_EXECUTOR = ThreadPoolExecutor(max_workers=ROUTING_WORKERS, thread_name_prefix="routing")
 
 
 def initiate_sessions():
-    global sessions
-    sessions = {}
+    global session_manager
+    session_manager = SessionManager()
     global node_list
     node_list = create_instance_list()
 
+    global grader
+    grader = AnswerGrader(remote=llm_grade)
+    global prefetcher
+    prefetcher = SpeculativePrefetcher()
+
+    # Parse the Wind River API catalog once, before the first question
+    get_catalog()
+    set_embeddings(create_embeddings())
+    get_fast_router()
+
+    # Clients are shared by every question, build them before the first one
+    CLIENTS.warm_up(client_specs())
+
+    register_stats()
+
+
+def register_stats():
+    # Exposed as gauges on /metrics next to the stage latencies
+    TRACER.register_stats("sessions", session_manager.stats)
+    TRACER.register_stats("request_limiter", REQUEST_LIMITER.stats)
+    TRACER.register_stats("llm_limiter", LLM_LIMITER.stats)
+    TRACER.register_stats("grader", grader.stats)
+    TRACER.register_stats("prefetch", prefetcher.stats)
+    TRACER.register_stats("routing_cache", ROUTING_CACHE.stats)
+    TRACER.register_stats("fast_router", get_fast_router().stats)
+    TRACER.register_stats("compaction", COMPACTOR.stats)
+    TRACER.register_stats("snapshot_cache", SNAPSHOT_CACHE.stats)
+    TRACER.register_stats("clients", CLIENTS.stats)
+    TRACER.register_stats("http_pool", HTTP_POOL.stats)
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        TRACER.register_stats("embedding_cache", embedding_cache.stats)
+
 
 def get_session(session_id):
-    return sessions.get(session_id)
+    return session_manager.get(session_id)
+
+
+def client_specs():
+    embeddings = ("hashing_embeddings", None, {}) if EMBEDDINGS_PROVIDER == "hashing" \
+        else ("openai_embeddings", None, {"api_key": OPENAI_API_KEY})
+    return [("openai", None, {"api_key": OPENAI_API_KEY}),
+            ("chat_openai", None, {"api_key": OPENAI_API_KEY}),
+            ("chat_openai", None, {"api_key": OPENAI_API_KEY, "temperature": 0.4}),
+            embeddings] + parse_llm_specs(WARM_LLMS)
 
 
 def new_session(aws_model_id, temperature):
-    # Create vectorstore
-    llm = Bedrock(
-        credentials_profile_name="windriver-poc-user",
-        model_id=aws_model_id,
-        region_name='us-east-1')
+    # Bedrock clients are thread safe and shared by sessions with the same model and temperature
+    llm = CLIENTS.get("bedrock", aws_model_id, temperature=float(temperature))
     session_id = str(uuid.uuid4())
-    memory, retriever = create_vectorstore(llm)
+    # Create vectorstore
+    memory, retriever, index = create_vectorstore(llm)
     # Create chat response generator
     generator = ConversationalRetrievalChain.from_llm(
                 llm=llm,
                 retriever=retriever,
                 memory=memory)
+    generator.combine_docs_chain.tags = [FINAL_ANSWER_TAG]
 
-    # Give the LLM date time context
+    # Give the LLM date time context, through the history instead of a generation
     query = f"From now on you will use {datetime.datetime.now()} as current datetime for any datetime related user query"
-    generator.invoke(query)
+    memory.chat_memory.add_user_message(query)
+    memory.chat_memory.add_ai_message("Understood.")
 
-    # Add session to sessions map
-    # sessions[session_id] = {"generator": generator, "llm": llm, "id": session_id}
-    # LOG.info(f"New session with ID: {session_id} initiated. Model: {model}, Temperature: {temperature}")
-    # return sessions[session_id]
+    # Register the session, the lock serializes questions made to the same session
+    session = {"generator": generator, "llm": llm, "memory": memory, "index": index, "id": session_id,
+               "lock": threading.Lock()}
+    session_manager.add(session)
+    LOG.info(f"New session with ID: {session_id} initiated. Model: {aws_model_id}, Temperature: {temperature}")
+    return session
 
 
 def create_logger():
@@ -71,35 +135,68 @@ def create_logger():
 
 
 def create_vectorstore(llm):
-    # Create Chroma vector store
-    data_start = "start vectorstore"
-    docs = [Document(page_content=x) for x in data_start]
-    vectorstore = Chroma.from_documents(documents=docs, embedding=OpenAIEmbeddings(openai_api_key = OPENAI_API_KEY))
+    # Create the session vector index, API responses are added to it over the session
+    index = SessionIndex(create_embeddings())
 
     memory = ConversationBufferMemory(
     llm=llm, memory_key="chat_history", return_messages=True)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 1})
+    retriever = index.as_retriever(k=RETRIEVER_K)
+
+    return memory, retriever, index
+
+
+def create_embeddings():
+    # The hashing embedder works offline, for tests and benchmarks
+    if EMBEDDINGS_PROVIDER == "hashing":
+        embeddings = CLIENTS.get("hashing_embeddings")
+    else:
+        embeddings = CLIENTS.get("openai_embeddings", api_key=OPENAI_API_KEY)
+    # Texts already embedded by any session or process are read from disk
+    return cached(embeddings)
 
-    return memory, retriever
 
+def ask(query, session, progress=None):
+    # One trace per question, every stage below adds its span to it
+    with TRACER.trace("ask"):
+        return answer_question(query, session, progress)
 
-def ask(query, session):
+
+def answer_question(query, session, progress=None):
     query_completion = query + ". If an API response is provided as context and in the provided API response doesn't have this information or no context is provided, make sure that your response is 'I don't know'. Unless the user explicitly ask for commands you will not provide any. Make sure to read the entire given context before giving your response."
     LOG.info(f"User query: {query}")
-    response = session['generator'].invoke(query_completion)
+    notify(progress, "stage", {"stage": "answering"})
+
+    # Routing and cluster fetch may run alongside the first attempt, in case it is not enough
+    prefetch = prefetcher.start(bind(prefetch_api_data), query, session)
+    try:
+        with LLM_LIMITER.slot(), span("first_answer") as first_answer:
+            response = session['generator'].invoke(query_completion)
+            first_answer.set(approx_tokens=approx_tokens(response['answer']))
+    except Exception:
+        if prefetch is not None:
+            prefetcher.discard(prefetch)
+        raise
 
     print(f'######{response}', file=sys.stderr)
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    prompt_status = client.chat.completions.create(model='gpt-3.5-turbo',
-                                                   messages=[{"role": "system",
-                                                              "content": "Your task is to understand the context of a text. Look for clues indicating whether the text provides information about a subject. If you come across phrases such as 'I'm sorry', 'no context', 'no information', or 'I don't know', it likely means there isn't enough information available. Similarly, if the text mentions not having access to the information, or if it offers directives without the user requesting them explicitly, the context is negative."},
-                                                             {"role": "user",
-                                                              "content": f"Based on the following text, check if the general context indicates that there is information about what is being asked or not. Make sure to answer only the words 'positive' if there is information, or 'negative' if there isn't. Don't answer nothing besides it.\nUser query {query}\nResponse: {response['answer']}"}])
-    print(f'prompt status: {prompt_status.choices[0].message.content}', file=sys.stderr)
-    if 'negative' in prompt_status.choices[0].message.content.lower():
+    # Local scorer first, the LLM is only asked about ambiguous answers
+    with span("grading") as grading:
+        prompt_status = grader.grade(query, response['answer'])
+        grading.set(status=prompt_status)
+    print(f'prompt status: {prompt_status}', file=sys.stderr)
+    if prompt_status == 'negative':
         LOG.info("Negative response from LLM")
-        feed_vectorstore(query, session)
-        response = session['generator'].invoke(query)
+        notify(progress, "stage", {"stage": "fetching cluster data"})
+        feed_vectorstore(query, session, progress, prefetch)
+
+        # Tokens of the final generation are streamed as they are generated
+        config = {"callbacks": [TokenStreamHandler(progress)]} if progress is not None else None
+        with LLM_LIMITER.slot(), span("final_generation") as generation:
+            response = session['generator'].invoke(query, config=config)
+            generation.set(approx_tokens=approx_tokens(response['answer']))
+    else:
+        if prefetch is not None:
+            prefetcher.discard(prefetch)
+        notify(progress, "token", response['answer'])
 
     # if "I'm sorry" in response['answer'] or "there is no information" in response['answer'] or "I don't know" in response['answer']:
     #     feed_vectorstore(query, session)
@@ -108,33 +205,67 @@ def ask(query, session):
     return response['answer']
 
 
-def feed_vectorstore(query, session):
-    response = api_response(query, session)
+def llm_grade(query, answer):
+    client = CLIENTS.get("openai", api_key=OPENAI_API_KEY)
+    with LLM_LIMITER.slot(), span("grading_llm"):
+        prompt_status = client.chat.completions.create(model='gpt-3.5-turbo',
+                                                       messages=[{"role": "system",
+                                                                  "content": "Your task is to understand the context of a text. Look for clues indicating whether the text provides information about a subject. If you come across phrases such as 'I'm sorry', 'no context', 'no information', or 'I don't know', it likely means there isn't enough information available. Similarly, if the text mentions not having access to the information, or if it offers directives without the user requesting them explicitly, the context is negative."},
+                                                                 {"role": "user",
+                                                                  "content": f"Based on the following text, check if the general context indicates that there is information about what is being asked or not. Make sure to answer only the words 'positive' if there is information, or 'negative' if there isn't. Don't answer nothing besides it.\nUser query {query}\nResponse: {answer}"}])
+        annotate(tokens=prompt_status.usage.total_tokens if prompt_status.usage else None)
+    return prompt_status.choices[0].message.content
+
+
+def prefetch_api_data(query, session):
+    # Routing events are held back, the client only hears about data that gets used
+    events = []
+    response, results = fetch_api_data(query, session, lambda event, data: events.append((event, data)))
+    return response, results, events
+
+
+def feed_vectorstore(query, session, progress=None, prefetch=None):
+    if prefetch is not None:
+        response, results, events = prefetcher.use(prefetch)
+        for event, data in events:
+            notify(progress, event, data)
+    else:
+        response, results = fetch_api_data(query, session, progress)
 
     if response is None:
         raise Exception('API response is null')
 
-    print(f'API response: {response}', file=sys.stderr)
+    print(f'API response: {response[:1000]}', file=sys.stderr)
 
     # regex = r"(?=.*\binternal\b)(?=.*\bserver\b)(?=.*\berror\b).+"
     # if re.search(regex, response.lower()):
     #     response = CLIENT_ERROR_MSG
 
-    text_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=0)
-    all_splits = text_splitter.split_text(response)
-    docs = [Document(page_content=x) for x in all_splits]
-    vectorstore = Chroma.from_documents(documents=docs, embedding=OpenAIEmbeddings(openai_api_key = OPENAI_API_KEY))
-
-    llm = session['llm']
-
-    memory = ConversationBufferMemory(
-    llm=llm, memory_key="chat_history", return_messages=True)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 1})
-
-    sessions[session['id']]['generator'] = ConversationalRetrievalChain.from_llm(
-                llm=llm,
-                retriever=retriever,
-                memory=memory)
+    # The session generator already retrieves from this index and keeps its memory
+    if results:
+        # Compact documents per pod, alarm, host..., large lists summarized to fit the token budget
+        with span("chunking") as chunking:
+            documents, report = COMPACTOR.compact(results, query)
+            chunking.set(**report)
+        LOG.info(f"Context compaction: {report['raw_bytes']} bytes/{report['raw_tokens']} tokens of API data "
+                 f"indexed as {report['documents']} documents, {report['bytes']} bytes/{report['tokens']} tokens")
+        for texts, metadatas in batched(documents, CHUNK_BATCH_SIZE):
+            with span("indexing", documents=len(texts)):
+                session['index'].add(texts, metadatas)
+        session['index'].retire_stale(documents)
+        indexed = len(documents)
+        tokens = {"tokens": report["tokens"], "tokens_saved": max(0, report["raw_tokens"] - report["tokens"])}
+    else:
+        # Errors and responses that are not JSON, rare enough to load the splitter on demand
+        from langchain.text_splitter import CharacterTextSplitter
+        text_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=0)
+        with span("chunking"):
+            splits = COMPACTOR.trim_texts(text_splitter.split_text(response))
+        with span("indexing", documents=len(splits)):
+            session['index'].add(splits)
+        indexed = len(splits)
+        tokens = {}
+    notify(progress, "context_indexed", {"documents": indexed, **tokens})
 
 
 def set_openai_key():
@@ -151,7 +282,7 @@ def set_openai_key():
 
 def is_api_key_valid(key):
     try:
-        client = OpenAI(api_key=key)
+        client = CLIENTS.get("openai", api_key=key)
         _ = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "system", "content": "This is a test."}],
@@ -173,7 +304,9 @@ def define_api_pool(query, session):
 
     output_parser = StrOutputParser()
     chain = prompt | session["llm"] | output_parser
-    response = chain.invoke({"input": complete_query})
+    with LLM_LIMITER.slot():
+        response = chain.invoke({"input": complete_query})
+    annotate(approx_tokens=approx_tokens(complete_query) + approx_tokens(response))
 
     print(f"###########{response}")
     if response.lower() == "kubernetes":
@@ -185,30 +318,150 @@ def define_api_pool(query, session):
 
 
 def api_response(query, session):
-    instance = define_system(query)
-    print(f'Query being made to {instance["name"]}', file=sys.stderr)
-    LOG.info(f'Query being made to {instance["name"]}')
-
-    print('Defining API pool', file=sys.stderr)
-    LOG.info('Defining API pool')
-    pool = define_api_pool(query, session)
-    print(f'LLM defined {pool} as the API subject', file=sys.stderr)
-    LOG.info(f'LLM defined {pool} as the API subject')
+    response, _ = fetch_api_data(query, session)
+    return response
+
+
+def fetch_api_data(query, session, progress=None):
+    # Returns the API response text and the parsed payload of each instance that answered
+    timings = {}
+    results = []
+
+    # Fleet wide questions run the same API on every targeted instance
+    targets = fanout_targets(query, node_list)
+
+    # Questions naming a single resource are routed by keywords, without any LLM call
+    fast_route = get_fast_router().route(query, node_list, fanout=bool(targets))
+
+    # Repeated questions reuse the instance, API pool and endpoint already resolved by the LLMs
+    route = ROUTING_CACHE.get(query, node_list) if fast_route is None else None
+    if fast_route is not None:
+        pool = fast_route['pool']
+        completion = fast_route['endpoint']
+        if targets:
+            instance = targets[0]
+        elif fast_route['instance'] is not None:
+            instance = fast_route['instance']
+        else:
+            instance = timed(timings, "instance_selection", define_system, query)
+        LOG.info(f'Fast route: {pool} API {completion} on {instance["name"]}')
+    elif route is not None:
+        instance = find_instance(route['instance'])
+        pool = route['pool']
+        completion = route['endpoint']
+        LOG.info(f'Routing cache hit: {pool} API {completion} on {instance["name"]}')
+    elif targets:
+        # Instances are already known, only the API pool is left to the LLM
+        instance = targets[0]
+        pool = timed(timings, "pool_selection", define_api_pool, query, session)
+        completion = None
+        print(f'LLM defined {pool} as the API subject', file=sys.stderr)
+        LOG.info(f'LLM defined {pool} as the API subject')
+    else:
+        # Instance and API pool classifications don't depend on each other
+        print('Defining instance and API pool', file=sys.stderr)
+        LOG.info('Defining instance and API pool')
+        start = time.perf_counter()
+        system_future = ROUTING_EXECUTOR.submit(bind(timed), timings, "instance_selection", define_system, query)
+        pool_future = ROUTING_EXECUTOR.submit(bind(timed), timings, "pool_selection", define_api_pool, query, session)
+        instance = system_future.result()
+        pool = pool_future.result()
+        timings["classification"] = time.perf_counter() - start
+        completion = None
+        print(f'LLM defined {pool} as the API subject', file=sys.stderr)
+        LOG.info(f'LLM defined {pool} as the API subject')
+
+    notify(progress, "instance_chosen", {"instances": [node['name'] for node in targets] or [instance['name']],
+                                         "pool": pool})
+
+    bot = create_request(pool, query, instance)
+    if bot is None:
+        return CLIENT_ERROR_MSG, results
+
+    if completion is None:
+        timed(timings, "endpoint_generation", bot.get_endpoint)
+        completion = bot.endpoint_path or "-1"
+
+    if len(targets) > 1 and completion != "-1":
+        print(f'Query being made to {len(targets)} instances', file=sys.stderr)
+        LOG.info(f'Query being made to {len(targets)} instances')
+        def on_result(node, success, _):
+            notify(progress, "api_called", {"instance": node['name'], "endpoint": completion, "success": success})
+
+        answered, failures = timed(timings, "api_request", fan_out, targets,
+                                   bind(lambda node: fetch_from_instance(pool, query, node, completion, results)),
+                                   on_result=on_result)
+        response = merge_results(answered, failures)
+        success = len(answered) > 0
+    else:
+        print(f'Query being made to {instance["name"]}', file=sys.stderr)
+        LOG.info(f'Query being made to {instance["name"]}')
+        response = timed(timings, "api_request", bot.get_API_response, completion)
+        success = bot.status_code == 200
+        notify(progress, "api_called", {"instance": instance['name'], "endpoint": bot.endpoint_path, "success": success})
+        if success and bot.payload is not None:
+            results.append({"instance": instance['name'], "endpoint": bot.endpoint_path, "payload": bot.payload,
+                            "raw_bytes": bot.raw_bytes, "fetched_at": bot.fetched_at})
+
+    # Only routes that reached a working API are worth remembering, keyword routes need no cache
+    if route is None and fast_route is None and success:
+        ROUTING_CACHE.put(query, node_list, {"instance": instance['name'],
+                                             "pool": pool,
+                                             "endpoint": bot.endpoint_path})
+    elif route is not None and not success:
+        ROUTING_CACHE.invalidate(query, node_list)
+
+    report_timings(timings)
+    return response, results
+
+
+def create_request(pool, query, instance):
     if pool == "Kubernetes":
-        bot = k8s_request(query, OPENAI_API_KEY, instance)
-        response = k8s_request.get_API_response(bot)
+        return k8s_request(query, OPENAI_API_KEY, instance)
     elif pool == "Wind River":
-        bot = wr_request(query, OPENAI_API_KEY, instance)
-        response = wr_request.get_API_response(bot)
-    else:
-        response = CLIENT_ERROR_MSG
+        return wr_request(query, OPENAI_API_KEY, instance)
+    return None
 
-    return response
+
+def fetch_from_instance(pool, query, instance, completion, results):
+    bot = create_request(pool, query, instance)
+    response = bot.get_API_response(completion)
+    if bot.status_code == 200 and bot.payload is not None:
+        results.append({"instance": instance['name'], "endpoint": bot.endpoint_path, "payload": bot.payload,
+                        "raw_bytes": bot.raw_bytes, "fetched_at": bot.fetched_at})
+    return bot.status_code == 200, response
+
+
+def timed(timings, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            return func(*args, **kwargs)
+    finally:
+        timings[stage] = time.perf_counter() - start
+
+
+def report_timings(timings):
+    stages = ", ".join(f"{stage}={duration * 1000:.0f}ms" for stage, duration in timings.items())
+    # Concurrent classifications only cost the slowest of them
+    critical = [stage for stage in ("instance_selection", "pool_selection") if stage in timings]
+    if len(critical) > 1:
+        slowest = max(critical, key=timings.get)
+        stages += f" (critical path: {slowest})"
+    print(f'Routing timings: {stages}', file=sys.stderr)
+    LOG.info(f'Routing timings: {stages}')
+
+
+def find_instance(name):
+    for node in node_list:
+        if node['name'] == name:
+            return node
+    return {}
 
 
 def define_system(query):
     # Initiate OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = CLIENTS.get("openai", api_key=OPENAI_API_KEY)
 
     # Expected llm response format
     format_response = "name: <name>"
@@ -219,23 +472,19 @@ def define_system(query):
 
 
     #Get completion
-    completion = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            temperature=0.5,
-            messages=[{"role": "system", "content": system_prompt},
-                      {"role": "user", "content": f"List of available instances: {node_list}\nUser query: {query}\n\n{user_prompt}"}]
-        )
-
+    with LLM_LIMITER.slot():
+        completion = client.chat.completions.create(
+                model="gpt-4-turbo-preview",
+                temperature=0.5,
+                messages=[{"role": "system", "content": system_prompt},
+                          {"role": "user", "content": f"List of available instances: {node_list}\nUser query: {query}\n\n{user_prompt}"}]
+            )
+
+    annotate(tokens=completion.usage.total_tokens if completion.usage else None)
     print(f'Completion: {completion.choices[0].message.content}', file=sys.stderr)
     name = completion.choices[0].message.content.split(":")[1].strip().replace(".", "")
     print(f'Result after normalization: {name}', file=sys.stderr)
-    node_dict = {}
-
-    # Iterate over each key-value pair
-    for node in node_list:
-        if node['name'] == name:
-            node_dict = node
-    return node_dict
+    return find_instance(name)
 
 
 def create_instance_list():
@@ -0,0 +1,205 @@
+import itertools
+import time
+
+# Fields that answer most questions about each kind of object, everything else is left out
+KIND_FIELDS = {
+    "alarms": ["alarm_id", "severity", "reason_text", "entity_instance_id", "alarm_state", "timestamp", "uuid"],
+    "ihosts": ["hostname", "personality", "administrative", "operational", "availability", "mgmt_ip", "uptime", "software_load"],
+    "certificates": ["certtype", "signature", "start_date", "expiry_date", "subject", "uuid"],
+    "subclouds": ["name", "id", "deploy-status", "availability-status", "management-state", "sync-status", "software-version"],
+    "isystems": ["name", "system_type", "system_mode", "software_version", "location", "timezone", "description"],
+}
+
+# Scalars of unknown objects are kept up to this amount
+MAX_GENERIC_FIELDS = 12
+
+# Bookkeeping fields that never answer a question
+NOISY_FIELDS = {"managedFields", "annotations", "uid", "resourceVersion", "selfLink", "ownerReferences",
+                "generation", "links"}
+
+
+def kind_from_endpoint(endpoint):
+    # /api/v1/namespaces/default/pods -> pods, 18002/v1/alarms?x=y -> alarms
+    path = (endpoint or "").split("?", 1)[0].rstrip("/")
+    return path.rsplit("/", 1)[-1] or "response"
+
+
+def iter_items(payload, kind):
+    # Yields (kind, item) for each object of list responses, or the object itself
+    if isinstance(payload, list):
+        for item in payload:
+            yield kind, item
+    elif isinstance(payload, dict):
+        # Kubernetes lists: {"kind": "PodList", "items": [...]}
+        if isinstance(payload.get("items"), list):
+            list_kind = payload.get("kind", "")
+            if list_kind.endswith("List") and len(list_kind) > 4:
+                kind = f"{list_kind[:-4].lower()}s"
+            for item in payload["items"]:
+                yield kind, item
+            return
+
+        # Wind River lists: {"alarms": [...]}
+        lists = [(key, value) for key, value in payload.items() if isinstance(value, list)]
+        if len(lists) == 1 and all(isinstance(item, dict) for item in lists[0][1]):
+            key, items = lists[0]
+            for item in items:
+                yield key, item
+            return
+
+        yield kind, payload
+    else:
+        yield kind, payload
+
+
+def ready_condition(status):
+    for condition in status.get("conditions") or []:
+        if condition.get("type") == "Ready":
+            return condition.get("status")
+    return None
+
+
+def describe_pod(fields, spec, status):
+    if "phase" in status:
+        fields["phase"] = status["phase"]
+    if "nodeName" in spec:
+        fields["node"] = spec["nodeName"]
+
+    containers = status.get("containerStatuses") or []
+    if containers:
+        fields["restarts"] = sum(container.get("restartCount", 0) for container in containers)
+        fields["ready"] = f"{sum(1 for container in containers if container.get('ready'))}/{len(containers)}"
+        waiting = [container["state"]["waiting"].get("reason") for container in containers
+                   if "waiting" in (container.get("state") or {})]
+        if waiting:
+            fields["waiting"] = ",".join(reason for reason in waiting if reason)
+
+    if "phase" not in fields and ready_condition(status) is not None:
+        fields["ready"] = ready_condition(status)
+
+
+def describe_event(fields, item):
+    involved = item.get("involvedObject") or {}
+    fields.update({"type": item.get("type"),
+                   "reason": item.get("reason"),
+                   "message": item.get("message"),
+                   "object": f"{involved.get('kind')}/{involved.get('name')}" if involved else None,
+                   "count": item.get("count"),
+                   "last_seen": item.get("lastTimestamp") or item.get("eventTime")})
+
+
+def describe_node(fields, metadata, spec, status):
+    roles = [label.split("/", 1)[1] for label in metadata.get("labels") or {}
+             if label.startswith("node-role.kubernetes.io/")]
+    info = status.get("nodeInfo") or {}
+    capacity = status.get("capacity") or {}
+    fields.update({"ready": ready_condition(status),
+                   "roles": ",".join(roles) or None,
+                   "unschedulable": spec.get("unschedulable"),
+                   "addresses": ",".join(f"{address.get('type')}={address.get('address')}"
+                                         for address in status.get("addresses") or []) or None,
+                   "kubelet": info.get("kubeletVersion"),
+                   "os": info.get("osImage"),
+                   "kernel": info.get("kernelVersion"),
+                   "runtime": info.get("containerRuntimeVersion"),
+                   "cpu": capacity.get("cpu"),
+                   "memory": capacity.get("memory"),
+                   "max_pods": capacity.get("pods")})
+
+
+def describe_service(fields, spec):
+    fields.update({"type": spec.get("type"),
+                   "cluster_ip": spec.get("clusterIP"),
+                   "ports": ",".join(f"{port.get('port')}/{port.get('protocol', 'TCP')}->{port.get('targetPort')}"
+                                     for port in spec.get("ports") or []) or None,
+                   "selector": ",".join(f"{key}={value}" for key, value in (spec.get("selector") or {}).items())
+                               or None})
+
+
+def describe_k8s(kind, item):
+    metadata = item.get("metadata", {})
+    spec = item.get("spec", {}) or {}
+    status = item.get("status", {}) or {}
+    fields = {"name": metadata.get("name"), "namespace": metadata.get("namespace")}
+
+    # Single objects carry their kind, list items the one of their endpoint
+    if item.get("kind"):
+        kind = f"{item['kind'].lower()}s"
+    if kind == "pods":
+        describe_pod(fields, spec, status)
+    elif kind == "events":
+        describe_event(fields, item)
+    elif kind == "nodes":
+        describe_node(fields, metadata, spec, status)
+    elif kind == "services":
+        describe_service(fields, spec)
+    else:
+        # Deployments, daemon sets, jobs... scalars of their spec and status
+        for section in (spec, status):
+            for key, value in section.items():
+                if len(fields) == MAX_GENERIC_FIELDS:
+                    break
+                if isinstance(value, (str, int, float, bool)) and value != "":
+                    fields[key] = value
+        if ready_condition(status) is not None:
+            fields["ready"] = ready_condition(status)
+    return {key: value for key, value in fields.items() if value is not None}
+
+
+def describe(kind, item):
+    if not isinstance(item, dict):
+        return {"value": item}
+
+    if "metadata" in item:
+        return describe_k8s(kind, item)
+
+    if kind in KIND_FIELDS:
+        return {key: item.get(key) for key in KIND_FIELDS[kind] if item.get(key) is not None}
+
+    fields = {}
+    for key, value in item.items():
+        if key in NOISY_FIELDS:
+            continue
+        if isinstance(value, (str, int, float, bool)) and value != "":
+            fields[key] = value
+            if len(fields) == MAX_GENERIC_FIELDS:
+                break
+    return fields
+
+
+def snapshot_document(result):
+    # Answers can tell how fresh the data is, the same snapshot always gives the same document
+    if result.get("fetched_at") is None:
+        return None
+    kind = kind_from_endpoint(result["endpoint"])
+    fetched = time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(result["fetched_at"]))
+    return (f"{kind} data from {result['instance']} ({result['endpoint']}) is a snapshot taken at {fetched}",
+            {"instance": result["instance"], "endpoint": result["endpoint"], "kind": "snapshot"})
+
+
+def iter_described(result):
+    # (kind, relevant fields) of each object of the response
+    kind = kind_from_endpoint(result["endpoint"])
+    for item_kind, item in iter_items(result["payload"], kind):
+        yield item_kind, describe(item_kind, item)
+
+
+def document_text(kind, instance, fields):
+    return f"{kind} from {instance}: " + ", ".join(f"{key}={value}" for key, value in fields.items())
+
+
+def batched(documents, size):
+    # Groups (text, metadata) pairs without building the whole list
+    documents = iter(documents)
+    while True:
+        batch = list(itertools.islice(documents, size))
+        if not batch:
+            return
+        yield [text for text, _ in batch], [metadata for _, metadata in batch]
+
+
+def parse_payload(response):
+    try:
+        return response.json()
+    except ValueError:
+        return None
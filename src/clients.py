@@ -0,0 +1,125 @@
+import threading
+import time
+
+from constants import (BEDROCK_ENDPOINT_URL, BEDROCK_PROFILE, BEDROCK_REGION, BEDROCK_STREAMING,
+                       LOG)
+from single_flight import SingleFlight
+
+
+def create_openai(model, api_key):
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+
+def create_chat_openai(model, api_key, temperature=None):
+    from langchain_openai import ChatOpenAI
+    params = {"openai_api_key": api_key}
+    if model is not None:
+        params["model"] = model
+    if temperature is not None:
+        params["temperature"] = temperature
+    return ChatOpenAI(**params)
+
+
+def create_openai_embeddings(model, api_key):
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=api_key)
+
+
+def create_hashing_embeddings(model):
+    from embeddings import HashingEmbeddings
+    return HashingEmbeddings()
+
+
+def create_bedrock(model, temperature):
+    from langchain_community.llms import Bedrock
+
+    # Titan models read the temperature from their generation config
+    if model.startswith("amazon."):
+        model_kwargs = {"textGenerationConfig": {"temperature": temperature}}
+    else:
+        model_kwargs = {"temperature": temperature}
+
+    return Bedrock(
+        credentials_profile_name=BEDROCK_PROFILE,
+        model_id=model,
+        region_name=BEDROCK_REGION,
+        endpoint_url=BEDROCK_ENDPOINT_URL,
+        model_kwargs=model_kwargs,
+        streaming=BEDROCK_STREAMING)
+
+
+class ClientRegistry():
+    # Clients are built on first use and shared: their HTTP pools and auth setup are reused by every call
+
+    def __init__(self):
+        self.factories = {}
+        self.clients = {}
+        self.lock = threading.Lock()
+
+        # Building a client for a key is done once, concurrent callers wait for it
+        self.building = SingleFlight()
+
+        self.hits = 0
+        self.misses = 0
+        self.construction_seconds = 0.0
+
+    def register(self, provider, factory):
+        self.factories[provider] = factory
+
+    def key(self, provider, model, params):
+        return (provider, model, tuple(sorted(params.items())))
+
+    def get(self, provider, model=None, **params):
+        key = self.key(provider, model, params)
+        with self.lock:
+            client = self.clients.get(key)
+            if client is not None:
+                self.hits += 1
+                return client
+            self.misses += 1
+
+        return self.building.do(key, lambda: self.build(key, provider, model, params))
+
+    def build(self, key, provider, model, params):
+        start = time.perf_counter()
+        client = self.factories[provider](model, **params)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.clients[key] = client
+            self.construction_seconds += elapsed
+        LOG.info(f"Built {provider} client for {model or 'default model'} in {elapsed * 1000:.1f}ms")
+        return client
+
+    def warm_up(self, specs):
+        # [(provider, model, params)], failures are logged and the client is built on first use instead
+        for provider, model, params in specs:
+            try:
+                self.get(provider, model, **params)
+            except Exception as e:
+                LOG.warning(f"Could not warm up {provider} client for {model}: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {"clients": len(self.clients), "hits": self.hits, "misses": self.misses,
+                    "construction_seconds": self.construction_seconds}
+
+
+CLIENTS = ClientRegistry()
+CLIENTS.register("openai", create_openai)
+CLIENTS.register("chat_openai", create_chat_openai)
+CLIENTS.register("openai_embeddings", create_openai_embeddings)
+CLIENTS.register("hashing_embeddings", create_hashing_embeddings)
+CLIENTS.register("bedrock", create_bedrock)
+
+
+def parse_llm_specs(specs):
+    # "model_id:temperature,model_id:temperature" -> bedrock warm up specs
+    parsed = []
+    for spec in filter(None, (spec.strip() for spec in specs.split(","))):
+        model_id, _, temperature = spec.rpartition(":")
+        try:
+            parsed.append(("bedrock", model_id, {"temperature": float(temperature)}))
+        except ValueError:
+            LOG.warning(f"Ignoring LLM warm up spec {spec}")
+    return parsed
@@ -0,0 +1,209 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from api_catalog import tokenize
+from chunker import document_text, iter_described, snapshot_document
+from constants import COMPACTION_ENCODING, COMPACTION_TOP_N, CONTEXT_TOKEN_BUDGET, LOG
+
+# Fields telling one object from another, left out when looking for repeated objects
+IDENTITY_FIELDS = ("name", "hostname", "uuid", "id", "mgmt_ip", "entity_instance_id")
+
+# Fields worth counting by value in list summaries
+STATUS_FIELDS = ("phase", "ready", "waiting", "severity", "alarm_state", "availability", "operational",
+                 "administrative", "availability-status", "deploy-status", "sync-status", "management-state")
+
+# Status values that need no attention, objects with other values rank first
+HEALTHY_VALUES = {"running", "succeeded", "available", "enabled", "unlocked", "online", "in-sync", "managed",
+                  "complete", "true", "clear", "none"}
+
+# A status with more distinct values than this is not worth counting
+MAX_SUMMARY_VALUES = 10
+
+READY_PATTERN = re.compile(r"^(\d+)/(\d+)$")
+
+
+class TokenCounter():
+    # tiktoken when its encoding can be loaded, otherwise about four characters per token
+
+    def __init__(self, encoding_name=COMPACTION_ENCODING):
+        self.encoding_name = encoding_name
+        self.encoding = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            try:
+                import tiktoken
+                self.encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                LOG.warning(f"tiktoken encoding {self.encoding_name} not available, estimating tokens: {e}")
+            self.loaded = True
+
+    def count(self, text):
+        if not self.loaded:
+            self.load()
+        if self.encoding is None:
+            return len(text) // 4
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+def unhealthy(fields):
+    for key in STATUS_FIELDS:
+        value = fields.get(key)
+        if value is None:
+            continue
+        ready = READY_PATTERN.match(str(value))
+        if ready:
+            if ready.group(1) != ready.group(2):
+                return True
+        elif str(value).lower() not in HEALTHY_VALUES:
+            return True
+    return False
+
+
+def identity(fields):
+    for key in IDENTITY_FIELDS:
+        if fields.get(key) is not None:
+            return str(fields[key])
+    return None
+
+
+class Compactor():
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, top_n=COMPACTION_TOP_N, counter=None):
+        self.budget = budget
+        self.top_n = top_n
+        self.counter = counter or TokenCounter()
+
+        self.lock = threading.Lock()
+        self.totals = {"questions": 0, "summarized": 0, "bytes_saved": 0, "tokens_saved": 0}
+
+    def score(self, query_words, fields):
+        # Objects named by the question and objects needing attention first
+        words = set(tokenize(" ".join(str(value) for value in fields.values())))
+        return len(words & query_words) + (2 if unhealthy(fields) else 0)
+
+    def group_text(self, kind, instance, items, limit=None):
+        # Objects equal but for their identity are described once, naming at most limit of them
+        shared = {key: value for key, value in items[0].items() if key not in IDENTITY_FIELDS}
+        names = [name for name in (identity(fields) for fields in items) if name is not None]
+        text = f"{len(items)} {kind} from {instance}"
+        if shared:
+            text += " with " + ", ".join(f"{key}={value}" for key, value in shared.items())
+        if names:
+            listed = names[:limit]
+            text += ": " + ", ".join(listed)
+            if len(names) > len(listed):
+                text += f" and {len(names) - len(listed)} more"
+        return text
+
+    def summary_text(self, kind, instance, items):
+        counts = OrderedDict()
+        for key in STATUS_FIELDS:
+            values = Counter(str(fields[key]) for fields in items if fields.get(key) is not None)
+            if values and len(values) <= MAX_SUMMARY_VALUES:
+                counts[key] = values
+        text = f"Summary of the {len(items)} {kind} from {instance}"
+        if counts:
+            text += ": " + "; ".join(f"{key} " + ", ".join(f"{value}={count}" for value, count in values.most_common())
+                                     for key, values in counts.items())
+        return text
+
+    def compact(self, results, query):
+        # -> [(text, metadata)] fitting the token budget, and a report of what was saved
+        query_words = set(tokenize(query))
+        fixed = []
+        candidates = []
+        for result in results:
+            snapshot = snapshot_document(result)
+            if snapshot is not None:
+                fixed.append(snapshot)
+
+            groups = OrderedDict()
+            described = OrderedDict()
+            for kind, fields in iter_described(result):
+                shape = tuple((key, str(value)) for key, value in fields.items() if key not in IDENTITY_FIELDS)
+                groups.setdefault((kind, shape), []).append(fields)
+                described.setdefault(kind, []).append(fields)
+
+            for (kind, _), items in groups.items():
+                metadata = {"instance": result["instance"], "endpoint": result["endpoint"], "kind": kind}
+                if len(items) == 1:
+                    text = short = document_text(kind, result["instance"], items[0])
+                else:
+                    # Every name while under the budget, the first top_n once it has to be summarized
+                    text = self.group_text(kind, result["instance"], items)
+                    short = self.group_text(kind, result["instance"], items, self.top_n)
+                candidates.append((self.score(query_words, items[0]), len(candidates), text, metadata, short))
+
+            # Counting questions can't be answered from the few documents retrieved, totals can
+            for kind, items in described.items():
+                if len(items) > 1:
+                    fixed.append((self.summary_text(kind, result["instance"], items),
+                                  {"instance": result["instance"], "endpoint": result["endpoint"], "kind": "summary"}))
+
+        tokens = {text: self.counter.count(text) for text, _ in fixed}
+        tokens.update((text, self.counter.count(text)) for _, _, text, _, _ in candidates)
+        total = sum(tokens.values())
+
+        summarized = total > self.budget
+        if not summarized:
+            documents = fixed + [(text, metadata) for _, _, text, metadata, _ in candidates]
+        else:
+            # Only the most relevant objects, as many as the budget leaves room for
+            documents = list(fixed)
+            used = sum(tokens[text] for text, _ in fixed)
+            kept = 0
+            for _, _, text, metadata, short in sorted(candidates, key=lambda candidate: (-candidate[0], candidate[1])):
+                if kept == self.top_n:
+                    break
+                # Groups keep every name while there is room for them
+                for option in (text, short):
+                    if option not in tokens:
+                        tokens[option] = self.counter.count(option)
+                    if used + tokens[option] <= self.budget:
+                        documents.append((option, metadata))
+                        used += tokens[option]
+                        kept += 1
+                        break
+
+        # Size of the responses as received, their tokens estimated rather than encoded on every question
+        raw_bytes = sum(result.get("raw_bytes") or 0 for result in results)
+        report = {"raw_bytes": raw_bytes,
+                  "raw_tokens": raw_bytes // 4,
+                  "bytes": sum(len(text.encode("utf-8")) for text, _ in documents),
+                  "tokens": sum(tokens[text] for text, _ in documents),
+                  "documents": len(documents),
+                  "summarized": summarized}
+        self.account(report)
+        return documents, report
+
+    def trim_texts(self, texts):
+        # Plain text responses: the first splits fitting the budget
+        kept = []
+        used = 0
+        for text in texts:
+            count = self.counter.count(text)
+            if used + count > self.budget:
+                break
+            kept.append(text)
+            used += count
+        return kept
+
+    def account(self, report):
+        with self.lock:
+            self.totals["questions"] += 1
+            self.totals["summarized"] += int(report["summarized"])
+            self.totals["bytes_saved"] += max(0, report["raw_bytes"] - report["bytes"])
+            self.totals["tokens_saved"] += max(0, report["raw_tokens"] - report["tokens"])
+
+    def stats(self):
+        with self.lock:
+            return dict(self.totals)
+
+
+COMPACTOR = Compactor()
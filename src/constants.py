@@ -1,5 +1,116 @@
 import logging
+import os
 
 CLIENT_ERROR_MSG = "No Wind River/Kubernetes API capable of answering your question was found!\nPleasy try again with another prompt."
 
-LOG = logging.getLogger("chatbot")
\ No newline at end of file
+LOG = logging.getLogger("chatbot")
+
+# Seconds before a Keystone token expires in which it will be refreshed
+TOKEN_REFRESH_MARGIN = int(os.environ.get('TOKEN_REFRESH_MARGIN', 300))
+
+# Pooled HTTP sessions used to reach the cluster APIs
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.5))
+
+# Candidate Wind River endpoints sent to the LLM after local retrieval, 0 disables retrieval
+ENDPOINT_TOP_K = int(os.environ.get('ENDPOINT_TOP_K', 5))
+
+# Cache of resolved (instance, API pool, endpoint) routes per question
+ROUTING_CACHE_SIZE = int(os.environ.get('ROUTING_CACHE_SIZE', 512))
+ROUTING_CACHE_TTL = int(os.environ.get('ROUTING_CACHE_TTL', 3600))
+# Cosine similarity for near-duplicate questions to share a route, 0 disables it
+ROUTING_CACHE_SIMILARITY = float(os.environ.get('ROUTING_CACHE_SIMILARITY', 0))
+
+# Threads running the instance and API pool classifications concurrently
+ROUTING_WORKERS = int(os.environ.get('ROUTING_WORKERS', 8))
+
+# Questions about many instances run the chosen API on each of them concurrently
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 32))
+FANOUT_TIMEOUT = float(os.environ.get('FANOUT_TIMEOUT', 60))
+
+# Limits of the vector index kept by each chat session
+SESSION_INDEX_MAX_DOCUMENTS = int(os.environ.get('SESSION_INDEX_MAX_DOCUMENTS', 2000))
+SESSION_INDEX_MAX_AGE = int(os.environ.get('SESSION_INDEX_MAX_AGE', 3600))
+
+# API response documents embedded per call to the embedding model
+CHUNK_BATCH_SIZE = int(os.environ.get('CHUNK_BATCH_SIZE', 256))
+# Documents retrieved as context, each one is a single pod, alarm, host...
+RETRIEVER_K = int(os.environ.get('RETRIEVER_K', 20))
+
+# Objects requested per page when listing Kubernetes resources
+K8S_PAGE_LIMIT = int(os.environ.get('K8S_PAGE_LIMIT', 500))
+
+# "dev" runs the Flask development server, "async" a gevent server with cooperative I/O
+SERVER_MODE = os.environ.get('SERVER_MODE', 'dev')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 2000))
+
+# Backpressure: questions in flight and concurrent outbound LLM calls
+MAX_INFLIGHT_REQUESTS = int(os.environ.get('MAX_INFLIGHT_REQUESTS', 64))
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 16))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 10))
+RETRY_AFTER = int(os.environ.get('RETRY_AFTER', 5))
+
+# Bedrock client used by the chat sessions
+BEDROCK_PROFILE = os.environ.get('BEDROCK_PROFILE', 'windriver-poc-user')
+BEDROCK_REGION = os.environ.get('BEDROCK_REGION', 'us-east-1')
+BEDROCK_ENDPOINT_URL = os.environ.get('BEDROCK_ENDPOINT_URL') or None
+BEDROCK_STREAMING = os.environ.get('BEDROCK_STREAMING', 'true').lower() == 'true'
+
+# "openai" or "hashing", a deterministic local embedder that needs no network
+EMBEDDINGS_PROVIDER = os.environ.get('EMBEDDINGS_PROVIDER', 'openai')
+
+# Answer sufficiency grading: "local" falls back to the LLM only for ambiguous answers,
+# "remote" always asks the LLM and "local-only" never does
+GRADER_MODE = os.environ.get('GRADER_MODE', 'local')
+GRADER_LOW = float(os.environ.get('GRADER_LOW', 0.3))
+GRADER_HIGH = float(os.environ.get('GRADER_HIGH', 0.7))
+# Labeled (query, answer, label) pairs, LLM decisions are appended and the local model trains on them
+GRADER_LOG_PATH = os.environ.get('GRADER_LOG_PATH', 'grader_log.jsonl')
+
+# Fetch cluster data in parallel with the first answer attempt, used only if that answer is negative
+SPECULATIVE_PREFETCH = os.environ.get('SPECULATIVE_PREFETCH', 'false').lower() == 'true'
+SPECULATIVE_WORKERS = int(os.environ.get('SPECULATIVE_WORKERS', 8))
+
+# Chat sessions: idle sessions and least recently used ones beyond the limits are dropped
+SESSION_IDLE_TTL = int(os.environ.get('SESSION_IDLE_TTL', 1800))
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 200))
+SESSIONS_MAX_BYTES = int(os.environ.get('SESSIONS_MAX_BYTES', 512 * 1024 * 1024))
+SESSION_SWEEP_INTERVAL = int(os.environ.get('SESSION_SWEEP_INTERVAL', 60))
+# LLM clients built at startup, "model_id:temperature" separated by commas
+WARM_LLMS = os.environ.get('WARM_LLMS', '')
+
+# Cluster API responses shared by every session, "path fragment=seconds" separated by commas.
+# The first fragment found in the endpoint path gives its TTL, 0 disables caching for it
+SNAPSHOT_TTLS = os.environ.get('SNAPSHOT_TTLS', 'alarms=15,ihosts=300,subclouds=60,pods=30,nodes=300,version=3600')
+SNAPSHOT_DEFAULT_TTL = float(os.environ.get('SNAPSHOT_DEFAULT_TTL', 30))
+# Responses read at least SNAPSHOT_HOT_HITS times since fetched are fetched again before expiring,
+# 0 disables the background refresher
+SNAPSHOT_REFRESH_INTERVAL = float(os.environ.get('SNAPSHOT_REFRESH_INTERVAL', 0))
+SNAPSHOT_HOT_HITS = int(os.environ.get('SNAPSHOT_HOT_HITS', 3))
+# Responses kept, the ones expiring first are dropped beyond it
+SNAPSHOT_MAX_ENTRIES = int(os.environ.get('SNAPSHOT_MAX_ENTRIES', 512))
+
+# Embeddings of indexed texts shared by sessions and processes, keyed by model and text.
+# Empty path disables the cache
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 200000))
+
+# Per stage spans of every question, logged as one line per question and exposed on /metrics
+TRACING = os.environ.get('TRACING', 'false').lower() == 'true'
+
+# Questions naming one resource (alarms, pods, hosts...) are routed by keywords, without LLM calls
+FAST_ROUTER = os.environ.get('FAST_ROUTER', 'true').lower() == 'true'
+
+# Context indexed for one question, in tokens of COMPACTION_ENCODING. Beyond it lists are summarized
+# into per status counts plus the COMPACTION_TOP_N items most relevant to the question
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 4000))
+COMPACTION_TOP_N = int(os.environ.get('COMPACTION_TOP_N', 25))
+COMPACTION_ENCODING = os.environ.get('COMPACTION_ENCODING', 'cl100k_base')
+
+# "eager" validates the OpenAI key and builds everything before opening the port, "background" opens
+# the port first and warms up in background, /ready tells when questions can be answered
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'eager')
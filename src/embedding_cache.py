@@ -0,0 +1,138 @@
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+from constants import EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_PATH, LOG
+from tracing import span
+
+# SQLite limits the number of parameters of a statement
+LOOKUP_BATCH = 500
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def model_name(embeddings):
+    # Vectors of different models or dimensions must never be mixed
+    if hasattr(embeddings, "dimensions") and not hasattr(embeddings, "model"):
+        return f"{type(embeddings).__name__}-{embeddings.dimensions}"
+    return f"{type(embeddings).__name__}-{getattr(embeddings, 'model', '')}"
+
+
+class EmbeddingCache():
+    # Content addressed vectors in SQLite, WAL mode lets several server processes share the file
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.lock = threading.Lock()
+
+        # Recency is a counter, not a clock: cheaper and immune to clock changes
+        self.clock = self.connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, keys):
+        found = {}
+        with self.lock:
+            self.clock += 1
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start + LOOKUP_BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = self.connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch)
+                found.update((key, np.frombuffer(vector, dtype=np.float32).tolist()) for key, vector in rows)
+                if found:
+                    self.connection.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})",
+                                            [self.clock] + batch)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, vectors):
+        # vectors: {key: vector}
+        with self.lock:
+            self.clock += 1
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), self.clock) for key, vector in vectors.items()])
+            self.evict()
+
+    def evict(self):
+        # Least recently used vectors go first, a tenth of the limit at once so eviction is rare
+        entries = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if entries <= self.max_entries:
+            return
+        excess = entries - self.max_entries + self.max_entries // 10
+        self.connection.execute("DELETE FROM embeddings WHERE key IN "
+                                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+        LOG.info(f"Embedding cache evicted {excess} vectors")
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            requests = self.hits + self.misses
+            return {"entries": entries, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / requests if requests else 0.0}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class CachedEmbeddings():
+    # Wraps LangChain style embeddings, only texts never seen before reach the model, in one call
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model_name(embeddings)
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model, text) for text in texts]
+        vectors = self.cache.lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            with span("embedding", texts=len(missing), cached=len(keys) - len(missing)):
+                embedded = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing, embedded))
+            self.cache.store(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        # Questions rarely repeat word by word, they are not worth a disk write
+        return self.embeddings.embed_query(text)
+
+
+cache = None
+cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    global cache
+    if cache is None and EMBEDDING_CACHE_PATH:
+        with cache_lock:
+            if cache is None:
+                cache = EmbeddingCache()
+    return cache
+
+
+def cached(embeddings):
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is None:
+        return embeddings
+    return CachedEmbeddings(embeddings, embedding_cache)
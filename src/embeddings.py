@@ -0,0 +1,35 @@
+import hashlib
+import math
+
+from api_catalog import tokenize
+
+
+class HashingEmbeddings():
+    # Deterministic, offline embedder: words and word bigrams are hashed into a fixed size vector.
+    # Follows the embed_documents/embed_query interface of LangChain embeddings so it can replace them.
+
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+
+    def features(self, text):
+        words = tokenize(text)
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def embed(self, text):
+        vector = [0.0] * self.dimensions
+        for feature in self.features(text):
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[index] += sign
+
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm:
+            vector = [value / norm for value in vector]
+        return vector
+
+    def embed_documents(self, texts):
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed(text)
@@ -0,0 +1,79 @@
+import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+
+from constants import FANOUT_TIMEOUT, FANOUT_WORKERS, LOG
+
+# "all subclouds", "which of the subclouds", "every instance"...
+FANOUT_PATTERN = re.compile(r"\b(all|every|each|which|any)\s+(?:of\s+the\s+|the\s+)?(sub\s?clouds?|instances?|clouds?)\b",
+                            re.IGNORECASE)
+
+# Bounded pool shared by every fan-out, so concurrent questions can't exhaust threads
+FANOUT_EXECUTOR = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+
+def match_instances(query, node_list):
+    # Instances named literally in the question, longest first so "subcloud10" beats "subcloud1".
+    # Returns them and the lowercased question without their names
+    query = query.lower()
+    found = []
+    for node in sorted(node_list, key=lambda node: len(node['name']), reverse=True):
+        pattern = r"(?<![\w-])" + re.escape(node['name'].lower()) + r"(?![\w-])"
+        if re.search(pattern, query):
+            found.append(node)
+            query = re.sub(pattern, " ", query)
+    return found, query
+
+
+def fanout_targets(query, node_list):
+    named, _ = match_instances(query, node_list)
+    if len(named) > 1:
+        return named
+
+    match = FANOUT_PATTERN.search(query)
+    if match is None:
+        return []
+
+    if match.group(2).lower().startswith("sub"):
+        return [node for node in node_list if node['type'] == "subcloud"]
+    return list(node_list)
+
+
+def fan_out(targets, fetch, timeout=FANOUT_TIMEOUT, on_result=None):
+    # fetch(node) returns (success, text), results are collected in arrival order
+    futures = {FANOUT_EXECUTOR.submit(fetch, node): node for node in targets}
+    results = []
+    failures = []
+
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            node = futures[future]
+            try:
+                success, text = future.result()
+            except Exception as e:
+                success, text = False, str(e)
+
+            if success:
+                results.append((node['name'], text))
+            else:
+                LOG.warning(f"Fan-out request to {node['name']} failed: {text}")
+                failures.append((node['name'], text))
+
+            if on_result is not None:
+                on_result(node, success, text)
+    except TimeoutError:
+        for future, node in futures.items():
+            if not future.done():
+                future.cancel()
+                LOG.warning(f"Fan-out request to {node['name']} timed out")
+                failures.append((node['name'], f"No response after {timeout} seconds"))
+
+    return results, failures
+
+
+def merge_results(results, failures):
+    merged = [f"Responses from {len(results)} of {len(results) + len(failures)} instances:"]
+    merged += [text for _, text in results]
+    if failures:
+        merged.append("Instances that could not be queried:")
+        merged += [f"{name}: {reason}" for name, reason in failures]
+    return "\n\n".join(merged)
@@ -0,0 +1,181 @@
+import threading
+
+from api_catalog import get_catalog, tokenize
+from constants import FAST_ROUTER, LOG
+from fanout import match_instances
+
+# Kubernetes collections and the words naming them, the LLM handles everything else
+K8S_RESOURCES = (
+    ("/api/v1/pods", ("pod",)),
+    ("/api/v1/nodes", ("node",)),
+    ("/api/v1/namespaces", ("namespace",)),
+    ("/api/v1/services", ("service",)),
+    ("/api/v1/events", ("event",)),
+    ("/api/v1/configmaps", ("configmap",)),
+    ("/api/v1/persistentvolumeclaims", ("pvc", "persistentvolumeclaim", "persistent volume claim")),
+    ("/api/v1/persistentvolumes", ("pv", "persistentvolume", "persistent volume")),
+    ("/apis/apps/v1/deployments", ("deployment",)),
+    ("/apis/apps/v1/daemonsets", ("daemonset",)),
+    ("/apis/apps/v1/statefulsets", ("statefulset",)),
+    ("/apis/apps/v1/replicasets", ("replicaset",)),
+    ("/apis/batch/v1/jobs", ("job",)),
+    ("/apis/batch/v1/cronjobs", ("cronjob",)),
+    ("/apis/networking.k8s.io/v1/ingresses", ("ingress", "ingresses")),
+    ("/version", ("kubernetes version", "k8s version")),
+)
+
+# Wind River APIs whose URL doesn't name what they return, an empty tuple leaves the API to the LLM.
+# The others are matched by the last segment of their URL (alarms, ihosts, certificate, subclouds)
+WR_KEYWORDS = {
+    "8119/v1.0/alarms": ("subcloud alarm",),
+    "6385/v1/isystems": ("system", "software version"),
+    "6385/v1/idns": ("dns",),
+    "6385/v1/intp": ("ntp",),
+    "6385/v1/registry_image": ("image", "registry"),
+    "6385/v1/clusters": (),
+    "15491/v1/query": ("patch", "patches"),
+    "15491/v1/query_hosts": ("patch host", "patches host"),
+    "7777/v1/services": ("service",),
+}
+
+# Words usually qualifying another resource: "pods on node x", "alarms of host y"
+WEAK_WORDS = {"host", "node", "namespace"}
+
+K8S_HINTS = set(tokenize("kubernetes k8s kubectl"))
+WR_HINTS = set(tokenize("wind river starlingx stx"))
+
+# The fan-out phrase names the targets, not the resource
+FANOUT_WORDS = set(tokenize("subclouds instances clouds"))
+
+
+class Rule():
+    __slots__ = ("pool", "endpoint", "words", "central_only")
+
+    def __init__(self, pool, endpoint, words, central_only=False):
+        self.pool = pool
+        self.endpoint = endpoint
+        self.words = frozenset(words)
+        self.central_only = central_only
+
+    @property
+    def weak(self):
+        return self.words <= WEAK_WORDS
+
+
+def url_keywords(url):
+    # "6385/v1/ihosts" -> "ihost" or "host"
+    words = tokenize(url.rsplit("/", 1)[-1])
+    keywords = [" ".join(words)]
+    if len(words) == 1 and words[0].startswith("i") and len(words[0]) > 4:
+        keywords.append(words[0][1:])
+    return keywords
+
+
+class FastRouter():
+
+    def __init__(self, catalog, enabled=FAST_ROUTER):
+        self.enabled = enabled
+        self.rules = []
+        for endpoint, keywords in K8S_RESOURCES:
+            self.add_rules("Kubernetes", endpoint, keywords)
+        for entry in catalog.entries:
+            # APIs about one object need its id, that only the LLM can pick from the context
+            if "<" in entry.url:
+                continue
+            keywords = WR_KEYWORDS.get(entry.url)
+            if keywords is None:
+                keywords = url_keywords(entry.url)
+            self.add_rules("Wind River", entry.url, keywords, entry.central_only)
+
+        # Word -> rules using it, a query only checks the rules sharing a word with it
+        self.by_word = {}
+        for rule in self.rules:
+            for word in rule.words:
+                self.by_word.setdefault(word, []).append(rule)
+
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "partial": 0, "misses": 0}
+
+        LOG.info(f"Fast router built {len(self.rules)} keyword rules")
+
+    def add_rules(self, pool, endpoint, keywords, central_only=False):
+        # Each keyword is an alternative, all the words of a keyword must be in the question
+        for keyword in keywords:
+            self.rules.append(Rule(pool, endpoint, tokenize(keyword), central_only))
+
+    def resolve(self, query, node_list, fanout=False):
+        instances, remaining = match_instances(query, node_list)
+        if len(instances) > 1 and not fanout:
+            return None
+
+        words = set(tokenize(remaining))
+        if fanout:
+            words -= FANOUT_WORDS
+
+        matched = {rule for word in words for rule in self.by_word.get(word, ()) if rule.words <= words}
+
+        # Pool named in the question
+        if words & K8S_HINTS and not words & WR_HINTS:
+            matched = {rule for rule in matched if rule.pool == "Kubernetes"}
+        elif words & WR_HINTS and not words & K8S_HINTS:
+            matched = {rule for rule in matched if rule.pool == "Wind River"}
+
+        # Qualifiers only count when nothing else was named, and specific rules hide the ones they contain
+        if any(not rule.weak for rule in matched):
+            matched = {rule for rule in matched if not rule.weak}
+        matched = {rule for rule in matched if not any(rule.words < other.words for other in matched)}
+
+        routes = {(rule.pool, rule.endpoint, rule.central_only) for rule in matched}
+        if len(routes) != 1:
+            return None
+        pool, endpoint, central_only = routes.pop()
+
+        if fanout:
+            return None if central_only else {"pool": pool, "endpoint": endpoint, "instance": None}
+
+        central = next((node for node in node_list if node['type'] == "central cloud"), None)
+        if instances:
+            instance = instances[0]
+            if central_only and instance is not central:
+                return None
+        elif central_only or "subcloud" not in words:
+            # Same default the instance selection prompt gives the LLM
+            instance = central
+        else:
+            # Some subcloud is meant but not named, the LLM picks it
+            instance = None
+        return {"pool": pool, "endpoint": endpoint, "instance": instance}
+
+    def route(self, query, node_list, fanout=False):
+        if not self.enabled:
+            return None
+
+        route = self.resolve(query, node_list, fanout)
+        with self.lock:
+            if route is None:
+                self.counts["misses"] += 1
+            elif route["instance"] is None and not fanout:
+                self.counts["partial"] += 1
+            else:
+                self.counts["hits"] += 1
+        return route
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        counts["hit_rate"] = (counts["hits"] + counts["partial"]) / total if total else 0.0
+        return counts
+
+
+router = None
+router_lock = threading.Lock()
+
+
+def get_fast_router():
+    global router
+    if router is None:
+        with router_lock:
+            if router is None:
+                router = FastRouter(get_catalog())
+    return router
@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from constants import GRADER_HIGH, GRADER_LOG_PATH, GRADER_LOW, GRADER_MODE, LOG
+
+# Phrases the LLM grader was told to look for, they mean the answer has no information
+NEGATIVE_PATTERN = re.compile(
+    r"i'?m sorry|i don'?t know|i do not know|no context|no information|not provided|not have access|"
+    r"no (?:api )?response",
+    re.IGNORECASE)
+
+# Negations are also valid answers: "controller-0 does not have any active alarms"
+NEGATION_PATTERN = re.compile(
+    r"(?:don'?t|do not|doesn'?t|does not) (?:have|contain|include|provide)|unable to|cannot (?:provide|find|access)|"
+    r"can'?t (?:provide|find|access)|not (?:able|possible) to",
+    re.IGNORECASE)
+
+# Commands offered without being asked for also count as a negative answer
+COMMAND_PATTERN = re.compile(r"\b(?:kubectl|system host-|fm alarm-|curl|you can (?:run|use)|run the following)\b",
+                             re.IGNORECASE)
+COMMAND_REQUEST_PATTERN = re.compile(r"\b(?:command|cli|how (?:do|can|to))\b", re.IGNORECASE)
+
+# Concrete data in the answer: numbers, ips, names with dashes, lists
+DATA_PATTERN = re.compile(r"\d|\b[a-z]+-[a-z0-9-]+\b|^\s*[-*]\s", re.IGNORECASE | re.MULTILINE)
+
+
+def phrase_score(query, answer):
+    # Probability that the answer has the requested information
+    if NEGATIVE_PATTERN.search(answer):
+        return 0.05
+    if NEGATION_PATTERN.search(answer):
+        # Between GRADER_LOW and GRADER_HIGH, the LLM decides. Still negative in local-only mode
+        return 0.45
+    if COMMAND_PATTERN.search(answer) and not COMMAND_REQUEST_PATTERN.search(query):
+        return 0.2
+    if len(answer.strip()) < 15:
+        return 0.5
+    if DATA_PATTERN.search(answer):
+        return 0.9
+    return 0.6
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+class NaiveBayesModel():
+    # Multinomial naive Bayes over the words of the answer
+
+    def __init__(self):
+        self.counts = {"positive": Counter(), "negative": Counter()}
+        self.documents = {"positive": 0, "negative": 0}
+        self.vocabulary = set()
+
+    def train(self, answers, labels):
+        for answer, label in zip(answers, labels):
+            if label not in self.counts:
+                continue
+            words = tokenize(answer)
+            self.counts[label].update(words)
+            self.documents[label] += 1
+            self.vocabulary.update(words)
+
+    def trained(self):
+        return all(count > 0 for count in self.documents.values())
+
+    def probability(self, answer):
+        total = sum(self.documents.values())
+        vocabulary = len(self.vocabulary) + 1
+        scores = {}
+        for label, counts in self.counts.items():
+            words = sum(counts.values())
+            score = math.log(self.documents[label] / total)
+            for word in tokenize(answer):
+                score += math.log((counts[word] + 1) / (words + vocabulary))
+            scores[label] = score
+
+        difference = scores["negative"] - scores["positive"]
+        if difference > 50:
+            return 0.0
+        return 1 / (1 + math.exp(difference))
+
+
+class AnswerGrader():
+
+    def __init__(self, remote=None, mode=GRADER_MODE, low=GRADER_LOW, high=GRADER_HIGH, log_path=GRADER_LOG_PATH):
+        # remote(query, answer) returns "positive" or "negative"
+        self.remote = remote
+        self.mode = mode
+        self.low = low
+        self.high = high
+        self.log_path = log_path
+
+        self.model = NaiveBayesModel()
+        self.load()
+
+        self.lock = threading.Lock()
+        self.decisions = Counter()
+
+    def load(self):
+        if not self.log_path or not os.path.exists(self.log_path):
+            return
+
+        answers = []
+        labels = []
+        with open(self.log_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    answers.append(entry["answer"])
+                    labels.append(entry["label"])
+                except (ValueError, KeyError):
+                    continue
+        self.model.train(answers, labels)
+        LOG.info(f"Answer grader trained with {len(answers)} logged answers")
+
+    def score(self, query, answer):
+        score = phrase_score(query, answer)
+        # The model keeps learning from remote grades made by other threads
+        with self.lock:
+            if self.model.trained():
+                score = (score + self.model.probability(answer)) / 2
+        return score
+
+    def grade(self, query, answer):
+        if self.mode != "remote":
+            score = self.score(query, answer)
+            if score <= self.low or (self.mode == "local-only" and score < 0.5):
+                return self.record("local", "negative")
+            if score >= self.high or self.mode == "local-only" or self.remote is None:
+                return self.record("local", "positive")
+
+        # Ambiguous answer, the LLM decides and its label is kept to train the local model
+        label = "negative" if "negative" in self.remote(query, answer).lower() else "positive"
+        self.save(query, answer, label)
+        return self.record("remote", label)
+
+    def record(self, source, label):
+        with self.lock:
+            self.decisions[(source, label)] += 1
+        return label
+
+    def save(self, query, answer, label):
+        with self.lock:
+            self.model.train([answer], [label])
+            if not self.log_path:
+                return
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps({"query": query, "answer": answer, "label": label}) + "\n")
+
+    def stats(self):
+        with self.lock:
+            decisions = dict(self.decisions)
+        total = sum(decisions.values())
+        local = sum(count for (source, _), count in decisions.items() if source == "local")
+        return {"decisions": total,
+                "local_rate": local / total if total else 0.0,
+                "remote_rate": (total - local) / total if total else 0.0,
+                "by_source": {f"{source}_{label}": count for (source, label), count in decisions.items()}}
@@ -0,0 +1,102 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from constants import (HTTP_BACKOFF, HTTP_CONNECT_TIMEOUT, HTTP_POOL_CONNECTIONS,
+                       HTTP_POOL_MAXSIZE, HTTP_READ_TIMEOUT, HTTP_RETRIES, LOG)
+
+
+class CountingAdapter(HTTPAdapter):
+
+    def pool_stats(self):
+        # urllib3 counts every request and every new connection per host:port pool,
+        # requests that did not need a new connection reused a pooled one
+        num_requests = 0
+        num_connections = 0
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+
+        return {"hits": max(num_requests - num_connections, 0), "misses": num_connections}
+
+
+class SessionPool():
+
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+
+        # Node host -> long lived session, shared by every port of that node
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create_session(self):
+        # Only idempotent GETs are retried, a token POST is never replayed
+        retry = Retry(total=self.retries,
+                      connect=self.retries,
+                      read=self.retries,
+                      backoff_factor=self.backoff,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(["GET"]),
+                      raise_on_status=False)
+        adapter = CountingAdapter(pool_connections=self.pool_connections,
+                                  pool_maxsize=self.pool_maxsize,
+                                  max_retries=retry)
+
+        session = requests.Session()
+        session.verify = False
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get_session(self, url):
+        host = urlsplit(url).hostname
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                LOG.info(f"Creating pooled HTTP session for {host}")
+                session = self.create_session()
+                self.sessions[host] = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", False)
+        return self.get_session(url).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            sessions = dict(self.sessions)
+
+        stats = {}
+        for host, session in sessions.items():
+            stats[host] = session.get_adapter("https://").pool_stats()
+        return stats
+
+    def close(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions = {}
+        for session in sessions:
+            session.close()
+
+
+HTTP_POOL = SessionPool()
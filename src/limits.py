@@ -0,0 +1,67 @@
+import threading
+from contextlib import contextmanager
+
+from constants import (LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT, LOG, MAX_INFLIGHT_REQUESTS,
+                       RETRY_AFTER)
+
+
+class Overloaded(Exception):
+
+    def __init__(self, message, retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter():
+
+    def __init__(self, name, limit, timeout=0, retry_after=RETRY_AFTER):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+        self.lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def acquire(self):
+        # A timeout of 0 rejects right away when every slot is taken
+        if self.timeout > 0:
+            acquired = self.semaphore.acquire(timeout=self.timeout)
+        else:
+            acquired = self.semaphore.acquire(blocking=False)
+
+        with self.lock:
+            if not acquired:
+                self.rejected += 1
+            else:
+                self.active += 1
+
+        if not acquired:
+            LOG.warning(f"{self.name} limit of {self.limit} reached")
+            raise Overloaded(f"Too many concurrent {self.name}, try again later", self.retry_after)
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+        self.semaphore.release()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self.lock:
+            return {"limit": self.limit, "active": self.active, "rejected": self.rejected}
+
+
+# Questions being answered, new ones are rejected when full
+REQUEST_LIMITER = ConcurrencyLimiter("requests", MAX_INFLIGHT_REQUESTS)
+
+# Outbound LLM calls, shared by every question, wait a bit for a free slot
+LLM_LIMITER = ConcurrencyLimiter("LLM calls", LLM_MAX_CONCURRENCY, timeout=LLM_QUEUE_TIMEOUT)
@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+
+from api_catalog import get_catalog
+from constants import LOG
+from embeddings import HashingEmbeddings
+
+
+class EndpointRetriever():
+
+    def __init__(self, entries, embeddings=None):
+        self.entries = tuple(entries)
+        self.embeddings = embeddings or HashingEmbeddings()
+
+        # Each action is embedded once, rows are normalized so a dot product is the cosine similarity
+        texts = [f"{entry.url.replace('/', ' ')} {entry.action}" for entry in self.entries]
+        matrix = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+
+        LOG.info(f"Endpoint retriever indexed {len(self.entries)} APIs with {type(self.embeddings).__name__}")
+
+    def top_k(self, query, k, allowed=None):
+        if not self.entries:
+            return []
+
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        scores = self.matrix @ vector
+
+        # Entries not available for the instance never become candidates
+        if allowed is not None:
+            mask = np.fromiter((entry in allowed for entry in self.entries), dtype=bool, count=len(self.entries))
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [self.entries[index] for index in best]
+
+
+retriever = None
+retriever_lock = threading.Lock()
+
+
+def get_retriever():
+    global retriever
+    if retriever is None:
+        with retriever_lock:
+            if retriever is None:
+                retriever = EndpointRetriever(get_catalog().entries)
+    return retriever
+
+
+def set_embeddings(embeddings):
+    # Backend picked by EMBEDDINGS_PROVIDER at startup, the catalog is embedded again with it
+    global retriever
+    with retriever_lock:
+        retriever = EndpointRetriever(get_catalog().entries, embeddings)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from constants import LOG, ROUTING_CACHE_SIMILARITY, ROUTING_CACHE_SIZE, ROUTING_CACHE_TTL
+from embeddings import HashingEmbeddings
+
+
+def normalize_query(query):
+    query = re.sub(r"[^\w\s-]", " ", query.lower())
+    return " ".join(query.split())
+
+
+def fingerprint(node_list):
+    # Routes are only valid for the same set of instances
+    nodes = sorted((node['name'], node['URL'], node['type']) for node in node_list)
+    return hashlib.sha1(json.dumps(nodes).encode("utf-8")).hexdigest()
+
+
+class RoutingCache():
+
+    def __init__(self, max_entries=ROUTING_CACHE_SIZE, ttl=ROUTING_CACHE_TTL,
+                 similarity=ROUTING_CACHE_SIMILARITY, embeddings=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.embeddings = embeddings or HashingEmbeddings()
+
+        # (normalized query, node fingerprint) -> {"route", "created", "vector"}
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def get(self, query, node_list):
+        normalized = normalize_query(query)
+        nodes = fingerprint(node_list)
+        key = (normalized, nodes)
+        now = time.time()
+
+        with self.lock:
+            self.expire(now)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry['route']
+
+        if self.similarity > 0:
+            route = self.get_similar(normalized, nodes)
+            if route is not None:
+                return route
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def get_similar(self, normalized, nodes):
+        vector = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+
+        with self.lock:
+            candidates = [(key, entry) for key, entry in self.entries.items() if key[1] == nodes]
+        if not candidates:
+            return None
+
+        matrix = np.stack([entry['vector'] for _, entry in candidates])
+        scores = matrix @ (vector / norm)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+
+        key, entry = candidates[best]
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.near_hits += 1
+        LOG.info(f"Routing cache near-duplicate match ({scores[best]:.2f}) with '{key[0]}'")
+        return entry['route']
+
+    def put(self, query, node_list, route):
+        normalized = normalize_query(query)
+        key = (normalized, fingerprint(node_list))
+
+        vector = None
+        if self.similarity > 0:
+            vector = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector = vector / norm
+
+        with self.lock:
+            self.entries[key] = {"route": route, "created": time.time(), "vector": vector}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, query, node_list):
+        with self.lock:
+            self.entries.pop((normalize_query(query), fingerprint(node_list)), None)
+
+    def expire(self, now):
+        # Entries are kept in usage order, so expiration has to check all of them
+        expired = [key for key, entry in self.entries.items() if now - entry['created'] > self.ttl]
+        for key in expired:
+            del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits,
+                    "near_hits": self.near_hits, "misses": self.misses}
+
+
+ROUTING_CACHE = RoutingCache()
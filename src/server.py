@@ -1,38 +1,133 @@
+import json
+import os
+
+if os.environ.get('SERVER_MODE') == 'async':
+    # Cooperative sockets: a question waiting on LLM or cluster I/O only holds a greenlet
+    from gevent import monkey
+    monkey.patch_all(select=False)
+
 from flask import Flask, Response, request
 from flask_restful import Api, Resource
 
-import app as chat
+from constants import RETRY_AFTER, SERVER_MODE, SERVER_PORT, STARTUP_MODE
+from limits import REQUEST_LIMITER, Overloaded
+from startup import READINESS
+from tracing import TRACER
+
+# The chatbot module, LangChain, Chroma and the LLM clients behind it take seconds to load: imported by the warm-up
+chat = None
 
 app = Flask(__name__)
 api = Api(app)
 
 
+def overloaded(error):
+    return Response(str(error), status=429, headers={"Retry-After": str(error.retry_after)},
+                    content_type="text/plain; charset=utf-8")
+
+
+def not_ready():
+    return Response(f"Service is {READINESS.status()['state']}, try again later", status=503,
+                    headers={"Retry-After": str(RETRY_AFTER)}, content_type="text/plain; charset=utf-8")
+
+
+def import_app():
+    global chat
+    import app
+    chat = app
+
+
+def warm_up_steps():
+    return [("importing", import_app),
+            ("validating OpenAI key", lambda: chat.set_openai_key()),
+            ("initiating sessions", lambda: chat.initiate_sessions())]
+
+
+def locked_ask(question, session, progress=None):
+    # Memory and index of a session are not shared by concurrent questions
+    with session['lock']:
+        return chat.ask(question, session, progress=progress)
+
+
 class Chat(Resource):
     def post(self):
+        if not READINESS.ready:
+            return not_ready()
         question = request.json['message']
         session_id = request.json['session_id']
         session = chat.get_session(session_id)
         if session is None:
             return Response("Session not found", status=404)
 
-        answer = chat.ask(question, session)
+        try:
+            REQUEST_LIMITER.acquire()
+        except Overloaded as e:
+            return overloaded(e)
+
+        # Streaming is opt-in, the plain text answer stays the default
+        if request.json.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+            from streaming import format_sse, stream_events
+            events = stream_events(locked_ask, question, session, on_finish=REQUEST_LIMITER.release)
+            return Response((format_sse(event, data) for event, data in events),
+                            content_type="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        try:
+            answer = locked_ask(question, session)
+        except Overloaded as e:
+            return overloaded(e)
+        finally:
+            REQUEST_LIMITER.release()
         response = Response(answer,content_type="text/plain; charset=utf-8" )
         return response
 
 class Session(Resource):
     def get(self):
+        if not READINESS.ready:
+            return not_ready()
         session_temp = request.headers['temperature']
         session_model = request.headers['model']
-        session = chat.new_session(session_model, session_temp)
+        try:
+            with REQUEST_LIMITER.slot():
+                session = chat.new_session(session_model, session_temp)
+        except Overloaded as e:
+            return overloaded(e)
 
         response = Response(session['id'],content_type="text/plain; charset=utf-8" )
         return response
 
 
+class Metrics(Resource):
+    def get(self):
+        # Not limited: it must answer while the server is overloaded
+        return Response(TRACER.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class Ready(Resource):
+    def get(self):
+        # Readiness probe: 200 once questions can be answered, 503 while warming up or after a failed start
+        status = READINESS.status()
+        return Response(json.dumps(status), status=200 if status["ready"] else 503, content_type="application/json")
+
+
 api.add_resource(Chat, '/chat')
 api.add_resource(Session, '/session')
+api.add_resource(Metrics, '/metrics')
+api.add_resource(Ready, '/ready')
 
 if __name__ == "__main__":
-    chat.set_openai_key()
-    chat.initiate_sessions()
-    app.run(host="0.0.0.0", port=2000)
\ No newline at end of file
+    if STARTUP_MODE != "background" and not READINESS.run(warm_up_steps()):
+        raise Exception(f"Startup failed: {READINESS.error}")
+    if SERVER_MODE == "async":
+        from gevent.pywsgi import WSGIServer
+        server = WSGIServer(("0.0.0.0", SERVER_PORT), app)
+        # Bound before the warm-up starts: its imports hold the event loop until they are done
+        server.start()
+        if STARTUP_MODE == "background":
+            READINESS.start(warm_up_steps())
+        server.serve_forever()
+    else:
+        if STARTUP_MODE == "background":
+            # The port opens right away, key validation and client warm-up happen meanwhile
+            READINESS.start(warm_up_steps())
+        app.run(host="0.0.0.0", port=SERVER_PORT)
@@ -0,0 +1,140 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from langchain_community.vectorstores import Chroma
+
+from constants import LOG, SESSION_INDEX_MAX_AGE, SESSION_INDEX_MAX_DOCUMENTS
+
+
+# chromadb creates its index directory on the first add without checking for races, new sessions wait for each other
+CREATION_LOCK = threading.Lock()
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SessionIndex():
+
+    def __init__(self, embeddings, max_documents=SESSION_INDEX_MAX_DOCUMENTS, max_age=SESSION_INDEX_MAX_AGE):
+        self.max_documents = max_documents
+        self.max_age = max_age
+
+        with CREATION_LOCK:
+            # One long lived collection per session, API responses are added to it
+            self.vectorstore = Chroma(collection_name=f"session-{uuid.uuid4()}", embedding_function=embeddings)
+
+            # Querying an empty collection fails, keep a placeholder that is never evicted
+            self.vectorstore.add_texts(["start vectorstore"], ids=["start"])
+
+        # Content hash -> time it was last added, oldest first
+        self.documents = OrderedDict()
+        # Content hash -> size of its text, used for the session memory accounting
+        self.sizes = {}
+        self.bytes = 0
+        # (instance, endpoint) -> content hashes of its latest snapshot, and the reverse
+        self.sources = {}
+        self.source_of = {}
+        self.lock = threading.Lock()
+
+    def add(self, texts, metadatas=None):
+        if metadatas is None:
+            metadatas = [None] * len(texts)
+
+        now = time.time()
+        new_texts = []
+        new_metadatas = []
+        new_ids = []
+        with self.lock:
+            for text, metadata in zip(texts, metadatas):
+                doc_id = content_hash(text)
+                if doc_id in self.documents or doc_id in new_ids:
+                    # Already embedded, only refresh its age
+                    if doc_id in self.documents:
+                        self.documents[doc_id] = now
+                        self.documents.move_to_end(doc_id)
+                    continue
+                new_texts.append(text)
+                new_metadatas.append(metadata or {"source": "api"})
+                new_ids.append(doc_id)
+
+        if new_texts:
+            self.vectorstore.add_texts(new_texts, metadatas=new_metadatas, ids=new_ids)
+            with self.lock:
+                for doc_id, text in zip(new_ids, new_texts):
+                    self.documents[doc_id] = now
+                    self.sizes[doc_id] = len(text.encode("utf-8"))
+                    self.bytes += self.sizes[doc_id]
+
+        LOG.info(f"Session index: {len(new_texts)} new documents, {len(texts) - len(new_texts)} already indexed")
+        self.evict()
+        return len(new_texts)
+
+    def retire_stale(self, documents):
+        # documents: [(text, metadata)] just indexed, the latest snapshot of each (instance, endpoint) they come from.
+        # Documents of an older snapshot of those sources are dropped, a pod that was Pending is now only Running
+        latest = {}
+        for text, metadata in documents:
+            if metadata and metadata.get("instance") is not None:
+                latest.setdefault((metadata["instance"], metadata.get("endpoint")), set()).add(content_hash(text))
+
+        with self.lock:
+            stale = []
+            for source, doc_ids in latest.items():
+                for doc_id in self.sources.get(source, set()) - doc_ids:
+                    del self.source_of[doc_id]
+                    if doc_id in self.documents:
+                        del self.documents[doc_id]
+                        self.bytes -= self.sizes.pop(doc_id, 0)
+                        stale.append(doc_id)
+                for doc_id in doc_ids:
+                    previous = self.source_of.get(doc_id)
+                    if previous is not None and previous != source:
+                        self.sources[previous].discard(doc_id)
+                    self.source_of[doc_id] = source
+                self.sources[source] = doc_ids
+
+        if stale:
+            self.vectorstore.delete(ids=stale)
+            LOG.info(f"Session index: dropped {len(stale)} documents of older snapshots")
+        return len(stale)
+
+    def evict(self):
+        now = time.time()
+        with self.lock:
+            expired = []
+            for doc_id, added in self.documents.items():
+                if now - added <= self.max_age and len(self.documents) - len(expired) <= self.max_documents:
+                    break
+                expired.append(doc_id)
+            for doc_id in expired:
+                del self.documents[doc_id]
+                self.bytes -= self.sizes.pop(doc_id, 0)
+                source = self.source_of.pop(doc_id, None)
+                if source is not None:
+                    self.sources[source].discard(doc_id)
+                    if not self.sources[source]:
+                        del self.sources[source]
+
+        if expired:
+            self.vectorstore.delete(ids=expired)
+            LOG.info(f"Session index: evicted {len(expired)} documents")
+
+    def close(self):
+        # Drops the session collection, the index can't be used afterwards
+        self.vectorstore.delete_collection()
+        with self.lock:
+            self.documents.clear()
+            self.sizes.clear()
+            self.bytes = 0
+            self.sources.clear()
+            self.source_of.clear()
+
+    def as_retriever(self, k=1):
+        return self.vectorstore.as_retriever(search_kwargs={"k": k})
+
+    def __len__(self):
+        return len(self.documents)
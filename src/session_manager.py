@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+from constants import (LOG, MAX_SESSIONS, SESSION_IDLE_TTL, SESSION_SWEEP_INTERVAL,
+                       SESSIONS_MAX_BYTES)
+
+
+def session_bytes(session):
+    # Approximate memory held by a session: indexed API documents plus chat history
+    history = sum(len(str(message.content).encode("utf-8")) for message in session['memory'].chat_memory.messages)
+    return session['index'].bytes + history
+
+
+class SessionManager():
+
+    def __init__(self, idle_ttl=SESSION_IDLE_TTL, max_sessions=MAX_SESSIONS, max_bytes=SESSIONS_MAX_BYTES,
+                 sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+
+        # Session id -> session, least recently used first
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+        if sweep_interval > 0:
+            threading.Thread(target=self.sweep_forever, daemon=True, name="session-sweeper").start()
+
+    def get(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session['last_used'] = time.time()
+                self.sessions.move_to_end(session_id)
+        return session
+
+    def add(self, session):
+        session['last_used'] = time.time()
+        with self.lock:
+            self.sessions[session['id']] = session
+        self.sweep()
+        return session
+
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            candidates = list(self.sessions.values())
+            count = len(candidates)
+
+        # Oldest first: idle ones always go, then as many as needed to fit the limits
+        total_bytes = sum(session_bytes(session) for session in candidates) if self.max_bytes > 0 else 0
+        evicted = []
+        for session in candidates:
+            idle = now - session['last_used'] > self.idle_ttl
+            over_limit = count > self.max_sessions or (self.max_bytes > 0 and total_bytes > self.max_bytes)
+            if not idle and not over_limit:
+                break
+            # A question is being answered, leave it for the next sweep
+            if session['lock'].locked():
+                continue
+            evicted.append(session)
+            count -= 1
+            if self.max_bytes > 0:
+                total_bytes -= session_bytes(session)
+
+        with self.lock:
+            for session in evicted:
+                self.sessions.pop(session['id'], None)
+            self.evicted += len(evicted)
+
+        for session in evicted:
+            self.close(session)
+        return len(evicted)
+
+    def close(self, session):
+        try:
+            session['index'].close()
+        except Exception as e:
+            LOG.warning(f"Could not drop index of session {session['id']}: {e}")
+        LOG.info(f"Session {session['id']} evicted")
+
+    def sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                LOG.warning(f"Session sweep failed: {e}")
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            evicted = self.evicted
+        return {"sessions": len(sessions),
+                "bytes": sum(session_bytes(session) for session in sessions),
+                "evicted": evicted}
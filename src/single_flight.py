@@ -0,0 +1,39 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight():
+    # Concurrent calls for the same key share one run of the function: one caller does the work
+    # (talks to Keystone, the cluster, builds a client), the others wait for its result or its exception
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.shared = 0
+
+    def do(self, key, func):
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[key] = future
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        # func stores its result where callers look first, so releasing the key afterwards leaves no gap
+        try:
+            result = func()
+        except BaseException as e:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.inflight[key]
+        future.set_result(result)
+        return result
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from constants import (LOG, SNAPSHOT_DEFAULT_TTL, SNAPSHOT_HOT_HITS, SNAPSHOT_MAX_ENTRIES,
+                       SNAPSHOT_REFRESH_INTERVAL, SNAPSHOT_TTLS)
+from single_flight import SingleFlight
+
+# One API response: payload is the parsed (and filtered) JSON, text the raw body, raw_bytes the size on the wire
+Snapshot = namedtuple("Snapshot", ["status_code", "payload", "text", "raw_bytes", "fetched_at"])
+
+
+def snapshot_age(snapshot):
+    return time.time() - snapshot.fetched_at
+
+
+def parse_ttls(spec):
+    # "alarms=15,ihosts=300" -> [("alarms", 15.0), ("ihosts", 300.0)]
+    ttls = []
+    for rule in filter(None, (rule.strip() for rule in spec.split(","))):
+        fragment, _, seconds = rule.partition("=")
+        try:
+            ttls.append((fragment.strip(), float(seconds)))
+        except ValueError:
+            LOG.warning(f"Ignoring snapshot TTL rule {rule}")
+    return ttls
+
+
+class SnapshotCache():
+
+    def __init__(self, ttls=SNAPSHOT_TTLS, default_ttl=SNAPSHOT_DEFAULT_TTL,
+                 refresh_interval=SNAPSHOT_REFRESH_INTERVAL, hot_hits=SNAPSHOT_HOT_HITS,
+                 max_entries=SNAPSHOT_MAX_ENTRIES):
+        self.ttls = parse_ttls(ttls)
+        self.default_ttl = default_ttl
+        self.refresh_interval = refresh_interval
+        self.hot_hits = hot_hits
+        self.max_entries = max_entries
+
+        # (instance, endpoint) -> {"snapshot", "expires_at", "loader", "hits" since it was fetched}
+        self.entries = {}
+
+        # Fetches in progress, shared by concurrent callers
+        self.flights = SingleFlight()
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+        self.evicted = 0
+
+        if refresh_interval > 0:
+            threading.Thread(target=self.refresh_forever, daemon=True, name="snapshot-refresher").start()
+
+    def ttl(self, endpoint):
+        path = urlsplit(endpoint).path
+        for fragment, seconds in self.ttls:
+            if fragment in path:
+                return seconds
+        return self.default_ttl
+
+    def get(self, instance, endpoint, loader):
+        # loader() -> (status_code, payload, text, raw_bytes), only successful responses are kept
+        key = (instance, endpoint)
+        ttl = self.ttl(endpoint)
+        if ttl <= 0:
+            return Snapshot(*loader(), time.time())
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['expires_at'] > time.time():
+                entry['hits'] += 1
+                self.hits += 1
+                return entry['snapshot']
+            self.misses += 1
+
+        return self.load(key, loader, ttl)
+
+    def load(self, key, loader, ttl):
+        return self.flights.do(key, lambda: self.fetch(key, loader, ttl))
+
+    def fetch(self, key, loader, ttl):
+        snapshot = Snapshot(*loader(), time.time())
+        with self.lock:
+            if snapshot.status_code == 200:
+                if key not in self.entries:
+                    self.prune()
+                self.entries[key] = {"snapshot": snapshot, "expires_at": snapshot.fetched_at + ttl,
+                                     "loader": loader, "hits": 0}
+        return snapshot
+
+    def hot(self, entry):
+        return self.refresh_interval > 0 and entry['hits'] >= self.hot_hits
+
+    def prune(self):
+        # Called with the lock held. Expired entries go unless the refresher is about to fetch them again,
+        # then the ones expiring first while the cache is full. Each entry holds a payload and its loader
+        now = time.time()
+        expired = [key for key, entry in self.entries.items()
+                   if entry['expires_at'] <= now - self.refresh_interval
+                   or (entry['expires_at'] <= now and not self.hot(entry))]
+        for key in expired:
+            del self.entries[key]
+        self.evicted += len(expired)
+
+        while self.entries and len(self.entries) >= self.max_entries:
+            del self.entries[min(self.entries, key=lambda key: self.entries[key]['expires_at'])]
+            self.evicted += 1
+
+    def refresh_forever(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh_hot()
+
+    def refresh_hot(self):
+        # Entries read often during their lifetime and expiring before the next round are fetched now,
+        # so readers never wait for them
+        deadline = time.time() + self.refresh_interval
+        with self.lock:
+            self.prune()
+            hot = [(key, entry['loader']) for key, entry in self.entries.items()
+                   if self.hot(entry) and entry['expires_at'] <= deadline]
+
+        for key, loader in hot:
+            try:
+                self.load(key, loader, self.ttl(key[1]))
+                self.refreshed += 1
+            except Exception as e:
+                LOG.warning(f"Background refresh of {key[1]} on {key[0]} failed: {e}")
+
+    def invalidate(self, instance, endpoint=None):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == instance and endpoint in (None, key[1])]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "shared_fetches": self.flights.shared, "refreshed": self.refreshed, "evicted": self.evicted,
+                    "hit_rate": self.hits / requests if requests else 0.0}
+
+
+SNAPSHOT_CACHE = SnapshotCache()
@@ -0,0 +1,55 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import LOG, SPECULATIVE_PREFETCH, SPECULATIVE_WORKERS
+
+
+class SpeculativePrefetcher():
+
+    def __init__(self, enabled=SPECULATIVE_PREFETCH, workers=SPECULATIVE_WORKERS):
+        self.enabled = enabled
+        # Own pool, the prefetched work submits to the routing pool itself
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch") if enabled else None
+
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def start(self, func, *args):
+        if not self.enabled:
+            return None
+        self.count("started")
+        return self.executor.submit(func, *args)
+
+    def use(self, future):
+        # Result of a prefetch that turned out to be needed
+        self.count("used")
+        return future.result()
+
+    def discard(self, future):
+        if future.cancel():
+            self.count("cancelled")
+            return
+
+        # Already running, its result is ignored once done
+        self.count("wasted")
+        future.add_done_callback(self.log_failure)
+
+    def log_failure(self, future):
+        if future.exception() is not None:
+            LOG.warning(f"Discarded prefetch failed: {future.exception()}")
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        started = counts.get("started", 0)
+        return {"enabled": self.enabled,
+                "started": started,
+                "used": counts.get("used", 0),
+                "cancelled": counts.get("cancelled", 0),
+                "wasted": counts.get("wasted", 0),
+                "hit_rate": counts.get("used", 0) / started if started else 0.0}
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from constants import LOG
+
+
+class Readiness():
+    # Startup progress reported by /ready: starting -> warming -> ready, or failed
+
+    def __init__(self):
+        self.state = "starting"
+        self.error = None
+        self.started = time.time()
+        self.stages = {}
+        self.ready_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def run(self, steps):
+        # steps: [(stage name, function)], run in order, the first failure stops the warm-up
+        with self.lock:
+            self.state = "warming"
+        for stage, step in steps:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                LOG.error(f"Startup failed while {stage}: {e}")
+                with self.lock:
+                    self.state = "failed"
+                    self.error = f"{stage}: {e}"
+                return False
+            with self.lock:
+                self.stages[stage] = time.perf_counter() - start
+
+        with self.lock:
+            self.state = "ready"
+            self.ready_at = time.time()
+        LOG.info(f"Ready in {self.ready_at - self.started:.2f}s: "
+                 + ", ".join(f"{stage}={duration * 1000:.0f}ms" for stage, duration in self.stages.items()))
+        return True
+
+    def start(self, steps):
+        thread = threading.Thread(target=self.run, args=(steps,), daemon=True, name="warm-up")
+        thread.start()
+        return thread
+
+    def status(self):
+        with self.lock:
+            return {"ready": self.state == "ready",
+                    "state": self.state,
+                    "error": self.error,
+                    "uptime": time.time() - self.started,
+                    "ready_after": self.ready_at - self.started if self.ready_at else None,
+                    "stages": dict(self.stages)}
+
+
+READINESS = Readiness()
@@ -0,0 +1,66 @@
+import json
+import queue
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from constants import LOG
+
+# Tag of the chain whose LLM tokens are sent to the user
+FINAL_ANSWER_TAG = "final_answer"
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    # Forwards the tokens generated inside the tagged chain, the condensed question is not streamed
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.final_runs = set()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        if FINAL_ANSWER_TAG in (tags or []) or parent_run_id in self.final_runs:
+            self.final_runs.add(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, parent_run_id=None, **kwargs):
+        if parent_run_id in self.final_runs:
+            self.progress("token", token)
+
+
+def notify(progress, event, data):
+    if progress is not None:
+        progress(event, data)
+
+
+def stream_events(func, *args, on_finish=None):
+    # Runs func(*args, progress=...) in a thread started right away and yields its (event, data) as they happen
+    events = queue.Queue()
+    done = object()
+
+    def progress(event, data):
+        events.put((event, data))
+
+    def run():
+        try:
+            events.put(("done", func(*args, progress=progress)))
+        except Exception as e:
+            LOG.error(f"Streamed request failed: {e}")
+            events.put(("error", str(e)))
+        finally:
+            if on_finish is not None:
+                on_finish()
+            events.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def drain():
+        while True:
+            item = events.get()
+            if item is done:
+                return
+            yield item
+
+    return drain()
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
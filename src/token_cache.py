@@ -0,0 +1,157 @@
+import datetime
+import threading
+import time
+
+from http_pool import HTTP_POOL
+from single_flight import SingleFlight
+from tracing import span
+
+from constants import LOG, TOKEN_REFRESH_MARGIN
+
+
+class TokenError(Exception):
+    pass
+
+
+def request_token(auth_url, user, password, project):
+    # Password login against Keystone, returns the token and its expiration
+    url = f"{auth_url}/v3/auth/tokens"
+    headers = {
+        "Content-Type": "application/json"
+    }
+    data = {
+        "auth": {
+            "identity": {
+                "methods": ["password"],
+                "password": {
+                    "user": {
+                        "name": user,
+                        "domain": {"id": "default"},
+                        "password": password
+                    }
+                }
+            },
+            "scope": {
+                "project": {
+                    "name": project,
+                    "domain": {"id": "default"}
+                }
+            }
+        }
+    }
+
+    try:
+        response = HTTP_POOL.post(url, headers=headers, json=data)
+    except Exception as e:
+        raise TokenError(f"An error ocurred while trying to retrieve the authentication for the Wind River APIs. Error:{e}")
+
+    if response.status_code != 201:
+        raise TokenError(f"Error trying to retrieve authentication token:\n {response.status_code}, {response.text}")
+
+    # Get token from response
+    x_auth_token = response.headers["x-subject-token"]
+    try:
+        expires_at = parse_expiration(response.json()['token']['expires_at'])
+    except Exception:
+        # Keystone did not inform the expiration, use its default lifetime
+        LOG.warning(f"Token from {auth_url} has no expiration, assuming one hour")
+        expires_at = time.time() + 3600
+
+    return x_auth_token, expires_at
+
+
+def parse_expiration(expires_at):
+    # Keystone format: 2024-01-31T12:00:00.000000Z
+    expires_at = expires_at.replace("Z", "+00:00")
+    return datetime.datetime.fromisoformat(expires_at).timestamp()
+
+
+class TokenCache():
+
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN, fetcher=request_token):
+        self.refresh_margin = refresh_margin
+        self.fetcher = fetcher
+
+        # (auth_url, user, project) -> {"token", "expires_at", "used", "timer"}
+        self.entries = {}
+
+        # Refreshes in progress, shared by concurrent callers
+        self.flights = SingleFlight()
+
+        self.lock = threading.Lock()
+
+    def get_token(self, auth_url, user, password, project="admin", force_refresh=False):
+        key = (auth_url, user, project)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if not force_refresh and entry is not None and entry['expires_at'] > time.time():
+                entry['used'] = True
+                return entry['token']
+
+        return self.refresh(key, password)
+
+    def refresh(self, key, password):
+        return self.flights.do(key, lambda: self.fetch(key, password))
+
+    def fetch(self, key, password):
+        auth_url, user, project = key
+        with span("token_fetch"):
+            token, expires_at = self.fetcher(auth_url, user, password, project)
+
+        with self.lock:
+            old_entry = self.entries.get(key)
+            if old_entry is not None and old_entry['timer'] is not None:
+                old_entry['timer'].cancel()
+
+            self.entries[key] = {
+                "token": token,
+                "expires_at": expires_at,
+                "used": False,
+                "timer": self.schedule_refresh(key, password, expires_at)
+            }
+
+        LOG.info(f"Keystone token for {user}@{auth_url} valid until {datetime.datetime.fromtimestamp(expires_at)}")
+        return token
+
+    def schedule_refresh(self, key, password, expires_at):
+        delay = expires_at - self.refresh_margin - time.time()
+        if delay <= 0:
+            return None
+
+        timer = threading.Timer(delay, self.background_refresh, args=(key, password))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def background_refresh(self, key, password):
+        # Tokens nobody asked for since the last refresh are dropped, not renewed forever
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            if not entry['used']:
+                del self.entries[key]
+                LOG.info(f"Keystone token for {key[1]}@{key[0]} unused since its last refresh, not renewed")
+                return
+        try:
+            self.refresh(key, password)
+        except Exception as e:
+            LOG.warning(f"Background refresh of Keystone token for {key[0]} failed: {e}")
+
+    def invalidate(self, auth_url, user, project="admin"):
+        with self.lock:
+            entry = self.entries.pop((auth_url, user, project), None)
+        if entry is not None and entry['timer'] is not None:
+            entry['timer'].cancel()
+
+    def clear(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries = {}
+        for entry in entries:
+            if entry['timer'] is not None:
+                entry['timer'].cancel()
+
+
+TOKEN_CACHE = TokenCache()
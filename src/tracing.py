@@ -0,0 +1,216 @@
+import contextvars
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from constants import LOG, TRACING
+
+# Upper bounds in seconds, the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_NAME = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
+
+# Spans of the question being answered by this thread or greenlet, and the innermost open span
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def approx_tokens(text):
+    # About four characters per token for English text and JSON, good enough to compare stages
+    return len(text) // 4 if text else 0
+
+
+class Histogram():
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span():
+    __slots__ = ("tracer", "name", "attributes", "start", "duration", "token")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.token = current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.duration = time.perf_counter() - self.start
+        current_span.reset(self.token)
+        if error_type is not None:
+            self.attributes["error"] = error_type.__name__
+        self.tracer.finish(self)
+        return False
+
+
+class NoSpan():
+    # Returned when tracing is off: no clock reads, no allocation, no locking
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+class Trace():
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.spans = []
+        self.token = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.token = current_trace.set(self)
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        current_trace.reset(self.token)
+        duration = time.perf_counter() - self.start
+        self.tracer.observe(self.name, duration)
+
+        stages = ", ".join(f"{span.name}={span.duration * 1000:.0f}ms"
+                           + "".join(f" {key}={value}" for key, value in span.attributes.items())
+                           for span in self.spans)
+        LOG.info(f"Trace {self.id} {self.name} {duration * 1000:.0f}ms: {stages}")
+        return False
+
+
+class Tracer():
+
+    def __init__(self, enabled=TRACING):
+        self.enabled = enabled
+        self.histograms = OrderedDict()
+        self.stats_providers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, attributes)
+
+    def trace(self, name):
+        if not self.enabled:
+            return NO_SPAN
+        return Trace(self, name)
+
+    def finish(self, span):
+        self.observe(span.name, span.duration)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append(span)
+
+    def observe(self, name, duration):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(duration)
+
+    def register_stats(self, name, provider):
+        # provider() -> dict of numbers, possibly nested, exported as gauges
+        self.stats_providers[name] = provider
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = ["# TYPE chatbot_stage_seconds histogram"]
+        with self.lock:
+            histograms = [(name, list(histogram.counts), histogram.sum, histogram.count, histogram.buckets)
+                          for name, histogram in self.histograms.items()]
+        for name, counts, total, count, buckets in histograms:
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'chatbot_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'chatbot_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'chatbot_stage_seconds_count{{stage="{name}"}} {count}')
+
+        gauges = OrderedDict()
+        for name, provider in self.stats_providers.items():
+            try:
+                stats = provider()
+            except Exception as e:
+                LOG.warning(f"Could not collect {name} stats: {e}")
+                continue
+            for metric, labels, value in flatten(f"chatbot_{name}", stats, ()):
+                gauges.setdefault(metric, []).append((labels, value))
+        for metric, samples in gauges.items():
+            lines.append(f"# TYPE {metric} gauge")
+            for labels, value in samples:
+                label_text = "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+                lines.append(f"{metric}{label_text} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def flatten(name, value, labels):
+    # Nested keys become part of the metric name, keys that can't be (hosts, URLs) become labels
+    if isinstance(value, bool):
+        yield name, labels, int(value)
+    elif isinstance(value, (int, float)):
+        yield name, labels, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            key = str(key)
+            if METRIC_NAME.match(key):
+                yield from flatten(f"{name}_{key}", item, labels)
+            else:
+                yield from flatten(name, item, labels + (("key", key.replace('"', "'")),))
+
+
+TRACER = Tracer()
+
+
+def span(name, **attributes):
+    return TRACER.span(name, **attributes)
+
+
+def annotate(**attributes):
+    # Adds token counts, sizes... to the innermost open span, if any
+    if TRACER.enabled:
+        span = current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+
+def bind(func):
+    # Work handed to another thread stays part of the question trace
+    if not TRACER.enabled:
+        return func
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        # A context can only be entered once at a time, concurrent calls get their own copy
+        return context.copy().run(func, *args, **kwargs)
+    return bound